@@ -1,12 +1,18 @@
 import os
-import pandas as pd
+from CSV转换工具 import OUTPUT_EXTENSIONS, ConversionManifest, convert_csv, detect_encoding, file_hash
 
 
-def csv_to_excel(input_folder, output_folder):
+def csv_to_excel(input_folder, output_folder, prune_orphans=False, dry_run=False,
+                 output_format='xlsx', split='sheets'):
     """
     将指定文件夹中的所有CSV文件转换为Excel文件并保存到新文件夹
+    只转换新增或内容有变化的文件，依据输出文件夹中的转换清单判断
     :param input_folder: CSV文件所在文件夹路径
     :param output_folder: Excel输出文件夹路径
+    :param prune_orphans: 是否删除源CSV已不存在的输出文件
+    :param dry_run: 只列出将要转换和删除的文件，不实际执行
+    :param output_format: 'xlsx'、'parquet' 或 'feather'
+    :param split: 超过Excel行数上限时 'sheets' 拆成多个工作表，'workbooks' 拆成多个文件
     """
     # 创建输出文件夹（如果不存在）
     os.makedirs(output_folder, exist_ok=True)
@@ -22,20 +28,39 @@ def csv_to_excel(input_folder, output_folder):
 
     # 转换计数器
     converted_count = 0
+    skipped_count = 0
+
+    manifest = ConversionManifest(output_folder)
+    extension = OUTPUT_EXTENSIONS[output_format]
+    excel_files = {os.path.splitext(f)[0] + extension for f in csv_files}
+    orphans = manifest.orphans(excel_files)
+    if prune_orphans and not dry_run:
+        for excel_file in orphans:
+            manifest.remove(excel_file)
+            print(f"已删除孤立输出: {excel_file}")
 
     # 处理每个CSV文件
     for csv_file in csv_files:
         try:
             # 构建完整文件路径
             csv_path = os.path.join(input_folder, csv_file)
-            excel_file = os.path.splitext(csv_file)[0] + '.xlsx'
+            excel_file = os.path.splitext(csv_file)[0] + extension
             excel_path = os.path.join(output_folder, excel_file)
 
-            # 读取CSV文件
-            df = pd.read_csv(csv_path)
+            # 源文件未变化则跳过
+            if manifest.is_fresh(excel_file, csv_path):
+                skipped_count += 1
+                continue
+            if dry_run:
+                print(f"[试运行] 将转换: {csv_file} -> {excel_file}")
+                continue
 
-            # 保存为Excel文件
-            df.to_excel(excel_path, index=False, engine='openpyxl')
+            # 流式读取CSV并保存为Excel文件
+            encoding = manifest.cached_encoding(excel_file, csv_path) or detect_encoding(csv_path)
+            outputs = convert_csv(csv_path, excel_path, encoding=encoding,
+                                  output_format=output_format, split=split)
+            manifest.record(excel_file, csv_path, encoding=encoding, hash=file_hash(csv_path),
+                            parts=[os.path.relpath(part, output_folder) for part in outputs])
 
             print(f"已转换: {csv_file} -> {excel_file}")
             converted_count += 1
@@ -43,8 +68,14 @@ def csv_to_excel(input_folder, output_folder):
         except Exception as e:
             print(f"转换失败: {csv_file} - 错误信息: {str(e)}")
 
+    manifest.save()
+    if dry_run:
+        for excel_file in orphans:
+            print(f"[试运行] 孤立输出{'（将删除）' if prune_orphans else ''}: {excel_file}")
+        return
+
     # 输出汇总结果
-    print(f"\n转换完成！成功转换 {converted_count}/{len(csv_files)} 个文件")
+    print(f"\n转换完成！成功转换 {converted_count}/{len(csv_files)} 个文件，跳过未变化 {skipped_count} 个")
     print(f"输出目录: {os.path.abspath(output_folder)}")
 
 
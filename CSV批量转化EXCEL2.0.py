@@ -1,12 +1,21 @@
 import os
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
+from CSV转换工具 import OUTPUT_EXTENSIONS, ConversionManifest, convert_csv_file
 
-def convert_all_csv(input_root, output_root):
+def convert_all_csv(input_root, output_root, workers=None, prune_orphans=False, dry_run=False,
+                    output_format='xlsx', split='sheets', dtype=None):
     """
     递归转换指定目录及其子目录下所有CSV文件为Excel文件
+    只转换新增或内容有变化的文件，依据输出根目录下的转换清单判断
     :param input_root: 输入根目录路径
     :param output_root: 输出根目录路径
+    :param workers: 并行进程数，默认CPU核数；为1时在当前进程内逐个转换
+    :param prune_orphans: 是否删除源CSV已不存在的输出文件
+    :param dry_run: 只列出将要转换和删除的文件，不实际执行
+    :param output_format: 'xlsx'、'parquet' 或 'feather'；后两者保留列类型，便于下游内存映射读取
+    :param split: 超过Excel行数上限时 'sheets' 拆成多个工作表，'workbooks' 拆成多个文件
+    :param dtype: 传给pandas.read_csv的列类型，如 {'备注': str}
     """
     # 统计计数器
     total_files = 0
@@ -14,60 +23,80 @@ def convert_all_csv(input_root, output_root):
     error_count = 0
     skipped_count = 0
 
-    # 遍历所有子目录
+    # 转换清单记录了源文件状态与编码，未变化的文件直接跳过
+    manifest = ConversionManifest(output_root)
+    current_keys = set()
+
+    # 遍历所有子目录，收集待转换文件
+    tasks = []
     for root, dirs, files in os.walk(input_root):
         # 筛选CSV文件
         csv_files = [f for f in files if f.lower().endswith('.csv')]
         total_files += len(csv_files)
 
-        # 创建进度条
-        with tqdm(csv_files, desc=f"处理目录: {os.path.basename(root)}", leave=False) as pbar:
-            for file in csv_files:
-                try:
-                    # 构建完整路径
-                    input_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(root, input_root)
-                    output_dir = os.path.join(output_root, relative_path)
-
-                    # 创建输出目录
-                    os.makedirs(output_dir, exist_ok=True)
+        for file in csv_files:
+            # 构建完整路径
+            input_path = os.path.join(root, file)
+            relative_path = os.path.relpath(root, input_root)
+            output_dir = os.path.join(output_root, relative_path)
 
-                    # 生成输出路径
-                    output_file = os.path.splitext(file)[0] + '.xlsx'
-                    output_path = os.path.join(output_dir, output_file)
+            # 生成输出路径
+            output_file = os.path.splitext(file)[0] + OUTPUT_EXTENSIONS[output_format]
+            output_path = os.path.join(output_dir, output_file)
+            key = os.path.relpath(output_path, output_root)
+            current_keys.add(key)
 
-                    # 跳过已存在的Excel文件
-                    if os.path.exists(output_path):
-                        skipped_count += 1
-                        pbar.update(1)
-                        continue
+            # 跳过源文件未变化的Excel文件
+            if manifest.is_fresh(key, input_path):
+                skipped_count += 1
+                continue
+            tasks.append((input_path, output_path, manifest.cached_encoding(key, input_path)))
 
-                    # 尝试不同编码读取CSV
-                    encodings = ['utf-8', 'gbk', 'latin1', 'iso-8859-1']
-                    for encoding in encodings:
-                        try:
-                            df = pd.read_csv(input_path, encoding=encoding)
-                            break
-                        except UnicodeDecodeError:
-                            continue
-                    else:
-                        raise UnicodeDecodeError("无法解码文件: 尝试了所有编码")
+    orphans = manifest.orphans(current_keys)
+    if dry_run:
+        print(f"[试运行] 需转换 {len(tasks)} 个文件，未变化 {skipped_count} 个，孤立输出 {len(orphans)} 个")
+        for input_path, output_path, _ in tasks:
+            print(f"  转换: {input_path} -> {output_path}")
+        for key in orphans:
+            print(f"  {'删除' if prune_orphans else '孤立'}: {os.path.join(output_root, key)}")
+        manifest.save()
+        return
+    if prune_orphans:
+        for key in orphans:
+            manifest.remove(key)
+        print(f"已删除孤立输出 {len(orphans)} 个")
 
-                    # 保存为Excel
-                    df.to_excel(output_path, index=False, engine='openpyxl')
+    workers = workers or os.cpu_count() or 1
+    with tqdm(total=len(tasks), desc="转换进度") as pbar:
+        if workers == 1:
+            results = ((task, convert_csv_file(*task, output_format, split, dtype)) for task in tasks)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            futures = {executor.submit(convert_csv_file, *task, output_format, split, dtype): task
+                       for task in tasks}
+            results = ((futures[future], future.result()) for future in as_completed(futures))
+        try:
+            for (input_path, output_path, _), (status, fields, message) in results:
+                if status == 'success':
                     success_count += 1
-                except Exception as e:
+                    fields['parts'] = [os.path.relpath(part, output_root) for part in fields['parts']]
+                    manifest.record(os.path.relpath(output_path, output_root), input_path, **fields)
+                else:
                     error_count += 1
                     print(f"\n错误文件: {input_path}")
-                    print(f"错误信息: {str(e)}")
-                finally:
-                    pbar.update(1)
+                    print(f"错误信息: {message}")
+                pbar.update(1)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            manifest.save()
 
     # 输出统计信息
     print(f"\n转换完成！")
     print(f"总文件数: {total_files}")
     print(f"成功转换: {success_count}")
-    print(f"跳过已存在: {skipped_count}")
+    print(f"跳过未变化: {skipped_count}")
     print(f"转换失败: {error_count}")
     print(f"输出根目录: {os.path.abspath(output_root)}")
 
@@ -77,4 +106,4 @@ if __name__ == "__main__":
     output_root = r"D:\统计建模\初步处理后的包含抑郁字样的数据\数字数据\数据集_赵\EXCEL转换结果"
 
     # 执行转换
-    convert_all_csv(input_root, output_root)
\ No newline at end of file
+    convert_all_csv(input_root, output_root)
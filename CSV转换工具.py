@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+CSV转换公共工具
+功能：分块读取CSV并以openpyxl只写模式流式写出Excel，内存占用与文件大小无关；
+     按字节采样判断文件编码，并把判断结果记入转换清单供下次复用；
+     转换清单同时记录源文件大小、修改时间和内容哈希，用于判断输出是否过期；
+     超过Excel行数上限时自动分表/分文件，也可输出带类型的Parquet/Feather
+"""
+
+import codecs
+import hashlib
+import json
+import os
+import pandas as pd
+
+from 数据读写 import EXCEL_MAX_ROWS, TableWriter, atomic_write, file_signature
+
+CHUNK_SIZE = 50000  # 每块读取的行数
+SNIFF_BYTES = 64 * 1024  # 编码判断时从文件头尾各采样的字节数
+ENCODINGS = ['utf-8', 'gbk', 'latin1']  # 候选编码，latin1可解码任意字节作为兜底
+MANIFEST_NAME = '.conversion_manifest.json'
+HASH_BLOCK = 1024 * 1024  # 计算内容哈希时每次读取的字节数
+OUTPUT_EXTENSIONS = {'xlsx': '.xlsx', 'parquet': '.parquet', 'feather': '.feather'}
+BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+
+def _decodes(data, encoding, final, max_skip=0):
+    """判断字节块能否按encoding解码；max_skip允许跳过开头被截断的半个字符"""
+    for skip in range(max_skip + 1):
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(data[skip:], final=final)
+            return True
+        except UnicodeDecodeError:
+            continue
+    return False
+
+
+def detect_encoding(path, sample_size=SNIFF_BYTES):
+    """
+    只读取文件头尾各sample_size字节判断编码，不解析整个文件
+    优先识别BOM，其次依次尝试utf-8、gbk，都失败时返回latin1
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(sample_size)
+        tail = b''
+        if size > 2 * sample_size:
+            f.seek(size - sample_size)
+            tail = f.read()
+
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+
+    whole = size <= len(head)
+    for encoding in ENCODINGS[:-1]:
+        # 采样块的结尾可能截断多字节字符，因此非完整文件时不要求final
+        if not _decodes(head, encoding, final=whole):
+            continue
+        if tail and not _decodes(tail, encoding, final=True, max_skip=3):
+            continue
+        return encoding
+    return ENCODINGS[-1]
+
+
+def file_hash(path):
+    """源文件内容哈希（blake2b-128），只在大小或修改时间变化时才需要计算"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ConversionManifest:
+    """
+    转换清单：以输出文件相对路径为键，记录源文件的大小、修改时间、内容哈希与编码
+    大小和修改时间都未变时直接视为未变化（只需一次stat），否则再比较内容哈希
+    """
+
+    def __init__(self, output_root):
+        self.output_root = output_root
+        self.path = os.path.join(output_root, MANIFEST_NAME)
+        self.entries = {}
+        self.dirty = False
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def cached_encoding(self, key, input_path):
+        """源文件大小和修改时间都未变时返回上次使用的编码"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if [entry['size'], entry['mtime_ns']] != file_signature(input_path):
+            return None
+        return entry.get('encoding')
+
+    def _outputs(self, key):
+        """一个源文件可能拆分成多个输出文件，清单中记录在parts字段"""
+        return self.entries.get(key, {}).get('parts', [key])
+
+    def is_fresh(self, key, input_path):
+        """全部输出文件存在且源文件内容未变时返回True"""
+        entry = self.entries.get(key)
+        if entry is None or not all(os.path.exists(os.path.join(self.output_root, part))
+                                    for part in self._outputs(key)):
+            return False
+        size, mtime_ns = file_signature(input_path)
+        if (entry['size'], entry['mtime_ns']) == (size, mtime_ns):
+            return True
+        if entry['size'] != size or entry.get('hash') != file_hash(input_path):
+            return False
+        # 仅修改时间变化（如被复制或touch），内容未变，更新记录即可
+        entry['mtime_ns'] = mtime_ns
+        self.dirty = True
+        return True
+
+    def record(self, key, input_path, **fields):
+        size, mtime_ns = file_signature(input_path)
+        self.entries[key] = dict(source=os.path.abspath(input_path), size=size,
+                                 mtime_ns=mtime_ns, **fields)
+        self.dirty = True
+
+    def orphans(self, current_keys):
+        """清单中有记录但源文件已不在本次扫描范围内的输出"""
+        return sorted(key for key in self.entries if key not in current_keys)
+
+    def remove(self, key):
+        """删除孤立的输出文件及其清单记录"""
+        for part in self._outputs(key):
+            output_path = os.path.join(self.output_root, part)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+        self.entries.pop(key, None)
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(self.output_root, exist_ok=True)
+        with atomic_write(self.path) as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1)
+        self.dirty = False
+
+
+def stream_csv_to_xlsx(input_path, output_path, encoding='utf-8', chunksize=CHUNK_SIZE,
+                       split='sheets', dtype=None):
+    """
+    流式转换单个CSV为Excel，单表写满Excel行数上限后自动续写
+    :param split: 'sheets' 在同一工作簿中新建工作表；'workbooks' 另存为 名称_2.xlsx、名称_3.xlsx…
+    :return: 写出的文件路径列表
+    """
+    base, ext = os.path.splitext(output_path)
+    outputs = [output_path]
+    writer = TableWriter(output_path)
+    # 按工作簿拆分时每个文件只写一个表，数据块在写满处切开
+    capacity = EXCEL_MAX_ROWS - 1
+    try:
+        for chunk in pd.read_csv(input_path, encoding=encoding, chunksize=chunksize, dtype=dtype):
+            while split == 'workbooks' and writer.count + len(chunk) > capacity:
+                take = capacity - writer.count
+                writer.write(chunk.iloc[:take])
+                chunk = chunk.iloc[take:]
+                writer.close()
+                outputs.append(f"{base}_{len(outputs) + 1}{ext}")
+                writer = TableWriter(outputs[-1])
+            writer.write(chunk)
+    except BaseException:
+        writer.discard()
+        raise
+    writer.close()
+    return outputs
+
+
+def stream_csv_to_arrow(input_path, output_path, encoding='utf-8', chunksize=CHUNK_SIZE, dtype=None):
+    """
+    流式转换单个CSV为Parquet或Feather(Arrow IPC)文件（按扩展名），列类型由首个数据块推断，
+    后续数据块类型冲突时自动放宽；也可通过dtype显式指定列类型（如 {'备注': str}）
+    :return: 写出的文件路径列表
+    """
+    writer = TableWriter(output_path)
+    try:
+        for chunk in pd.read_csv(input_path, encoding=encoding, chunksize=chunksize, dtype=dtype):
+            writer.write(chunk)
+    except BaseException:
+        writer.discard()
+        raise
+    if writer.count == 0:
+        writer.discard()
+        raise ValueError("CSV文件为空")
+    writer.close()
+    return [output_path]
+
+
+def convert_csv(input_path, output_path, encoding='utf-8', output_format='xlsx', split='sheets',
+                dtype=None):
+    """按输出格式分派转换，返回写出的文件路径列表"""
+    if output_format == 'xlsx':
+        return stream_csv_to_xlsx(input_path, output_path, encoding=encoding, split=split, dtype=dtype)
+    return stream_csv_to_arrow(input_path, output_path, encoding=encoding, dtype=dtype)
+
+
+def convert_csv_file(input_path, output_path, encoding=None, output_format='xlsx', split='sheets',
+                     dtype=None):
+    """
+    转换单个CSV文件（可在子进程中执行）
+    :param encoding: 已知编码（来自转换清单），为None时按字节采样判断
+    :param output_format: 'xlsx'、'parquet' 或 'feather'
+    :param split: 超过Excel行数上限时的拆分方式，'sheets' 或 'workbooks'
+    :param dtype: 传给pandas.read_csv的列类型
+    :return: (状态, 清单字段, 错误信息)，状态为 'success' 或 'error'
+    """
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        encoding = encoding or detect_encoding(input_path)
+        # 采样判断正确时只解析一次；仅当采样未覆盖的字节解码失败才换下一个编码
+        candidates = [encoding] + [e for e in ENCODINGS if e != encoding]
+        for candidate in candidates:
+            try:
+                outputs = convert_csv(input_path, output_path, encoding=candidate,
+                                      output_format=output_format, split=split, dtype=dtype)
+                return 'success', {'encoding': candidate, 'hash': file_hash(input_path),
+                                   'parts': outputs}, None
+            except UnicodeDecodeError:
+                continue
+        raise ValueError("无法解码文件: 尝试了所有编码")
+    except Exception as e:
+        return 'error', None, str(e)
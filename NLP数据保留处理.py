@@ -1,28 +1,155 @@
-import pandas as pd
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from 数据读写 import TableWriter, intermediate_path, iter_table_chunks
+from 近重复检测 import NearDuplicateIndex, content_key
 
-def filter_depression_data(input_path):
+try:
+    import ahocorasick  # pyahocorasick，可选依赖
+except ImportError:
+    ahocorasick = None
 
-    df = pd.read_excel(input_path)
+# ========== 用户配置 ==========
+KEYWORDS = ['抑郁']  # 需要保留的关键词，任一命中即保留
+TEXT_COLUMNS = ('question', 'answer')  # 参与匹配的文本列
+CHUNK_SIZE = 20000  # 每块读取的行数，决定内存占用上限
+# ============================
 
-    # 将可能存在的空值转换为空字符串
-    df['question'] = df['question'].fillna('').astype(str)
-    df['answer'] = df['answer'].fillna('').astype(str)
 
-    # 筛选包含"抑郁"的行
-    filtered_df = df[
-        df['question'].str.contains('抑郁') |
-        df['answer'].str.contains('抑郁')
-        ]
+class KeywordMatcher:
+    """多关键词单遍匹配：优先使用Aho–Corasick自动机，未安装pyahocorasick时退回正则多选预筛"""
 
-    # 保存结果到新文件
-    output_path = input_path.replace(".xlsx", "_filtered.xlsx")
-    filtered_df.to_excel(output_path, index=False)
-    print(f"筛选完成！共保留 {len(filtered_df)} 条数据，已保存至: {output_path}")
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(keywords))
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for keyword in self.keywords:
+                self._automaton.add_word(keyword, keyword)
+            self._automaton.make_automaton()
+        else:
+            self._automaton = None
+            self._pattern = re.compile('|'.join(
+                re.escape(keyword) for keyword in sorted(self.keywords, key=len, reverse=True)))
 
+    def find(self, text):
+        """返回文本中出现的全部关键词集合（含相互重叠的关键词）"""
+        if self._automaton is not None:
+            return {keyword for _, keyword in self._automaton.iter(text)}
+        if not self._pattern.search(text):
+            return set()
+        return {keyword for keyword in self.keywords if keyword in text}
 
-# 文件路径配置
-file_path = r"D:\统计建模\cMedQA-master\answers.csv\QA1.xlsx"
 
-# 执行筛选
-filter_depression_data(file_path)
+@lru_cache(maxsize=8)
+def _get_matcher(keywords):
+    # 每个进程只构建一次自动机
+    return KeywordMatcher(keywords)
 
+
+def combine_text(chunk):
+    """各文本列以换行拼接为一条记录文本，空值按空字符串处理；匹配、去重与聚类共用"""
+    texts = chunk[TEXT_COLUMNS[0]].fillna('').astype(str)
+    for col in TEXT_COLUMNS[1:]:
+        texts = texts + '\n' + chunk[col].fillna('').astype(str)
+    return texts
+
+
+def _filter_chunk(chunk, keywords):
+    """匹配一个数据块，返回命中的行和各关键词命中行数"""
+    matcher = _get_matcher(keywords)
+    for col in TEXT_COLUMNS:
+        # 将可能存在的空值转换为空字符串
+        chunk[col] = chunk[col].fillna('').astype(str)
+    combined = combine_text(chunk)
+    found = combined.map(matcher.find)
+    hits = Counter()
+    for keywords_found in found:
+        hits.update(keywords_found)
+    return chunk[found.map(bool)], hits
+
+
+def iter_chunks(input_path, chunksize=CHUNK_SIZE, columns=None, dtype=None):
+    """按块读取CSV、xlsx或Parquet/Feather，不把整个文件载入内存；columns/dtype见iter_table_chunks"""
+    return iter_table_chunks(input_path, chunksize, columns=columns, dtype=dtype)
+
+
+def _drop_near_duplicates(matched, dedupe, source):
+    """命中行逐条加入近重复索引，只保留不与已见记录重复的行"""
+    if matched.empty:
+        # 空列表作下标会选出零列而不是零行
+        return matched
+    keep = [dedupe.add(content_key(f"{source}:{row}", text), text) is None
+            for row, text in zip(matched.index, combine_text(matched))]
+    return matched[keep]
+
+
+def filter_depression_data(input_path, keywords=KEYWORDS, output_path=None, chunksize=CHUNK_SIZE,
+                           workers=None, dedupe_path=None, dedupe_threshold=0.8):
+    """
+    流式关键词筛选：分块读取，单遍匹配全部关键词，命中行增量写出
+    :param keywords: 关键词列表，任一命中即保留
+    :param output_path: 输出路径，默认在原文件名后加_filtered并存为中间结果格式（Parquet）
+    :param workers: 并行进程数，默认CPU核数；为1时在当前进程内处理
+    :param dedupe_path: 近重复签名索引路径，给出时丢弃与已见记录近似重复的行（跨文件、跨运行）
+    :param dedupe_threshold: 近重复的Jaccard相似度阈值
+    :return: 各关键词命中行数
+    """
+    if output_path is None:
+        output_path = intermediate_path(input_path, '_filtered')
+    keywords = tuple(keywords)
+    workers = workers or os.cpu_count() or 1
+
+    hits = Counter()
+    writer = TableWriter(output_path)
+    dedupe = NearDuplicateIndex(dedupe_path, threshold=dedupe_threshold) if dedupe_path else None
+    source = os.path.abspath(input_path)
+    matched_count = 0
+
+    def collect(matched, chunk_hits):
+        nonlocal matched_count
+        matched_count += len(matched)
+        if dedupe is not None:
+            matched = _drop_near_duplicates(matched, dedupe, source)
+        writer.write(matched)
+        hits.update(chunk_hits)
+
+    try:
+        if workers == 1:
+            for chunk in iter_chunks(input_path, chunksize):
+                collect(*_filter_chunk(chunk, keywords))
+        else:
+            # 在途数据块不超过进程数的2倍，保证内存有上限且输出保持原始行序
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                in_flight = []
+                for chunk in iter_chunks(input_path, chunksize):
+                    in_flight.append(executor.submit(_filter_chunk, chunk, keywords))
+                    if len(in_flight) >= workers * 2:
+                        collect(*in_flight.pop(0).result())
+                for future in in_flight:
+                    collect(*future.result())
+    except BaseException:
+        # 中途失败时保留上一次的输出，不用不完整的结果覆盖
+        writer.discard()
+        if dedupe is not None:
+            dedupe.close()
+        raise
+    writer.close()
+    if dedupe is not None:
+        print(f"关键词命中 {matched_count} 条，去除近重复 {matched_count - writer.count} 条")
+        dedupe.report()
+        dedupe.close()
+
+    print(f"筛选完成！共保留 {writer.count} 条数据，已保存至: {output_path}")
+    for keyword in keywords:
+        print(f"  {keyword}: {hits[keyword]} 条")
+    return hits
+
+
+if __name__ == "__main__":
+    # 文件路径配置
+    file_path = r"D:\统计建模\cMedQA-master\answers.csv\QA1.xlsx"
+
+    # 执行筛选
+    filter_depression_data(file_path)
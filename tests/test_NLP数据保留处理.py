@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from NLP数据保留处理 import filter_depression_data  # noqa: E402
+from 数据读写 import read_table  # noqa: E402
+
+
+@pytest.mark.parametrize('hit_rows', [range(5, 10), range(0, 5)],
+                         ids=['首块无命中', '后续块无命中'])
+def test_dedupe_with_chunk_without_hits(tmp_path, hit_rows):
+    questions = [f"第{i}个问题：孩子抑郁第{i}天了" if i in hit_rows else f"第{i}个问题：感冒发烧"
+                 for i in range(10)]
+    input_path = tmp_path / 'qa.csv'
+    pd.DataFrame({'question': questions, 'answer': [f"回答{i}" for i in range(10)]}).to_csv(
+        input_path, index=False)
+    output_path = str(tmp_path / 'qa_filtered.parquet')
+
+    filter_depression_data(str(input_path), keywords=['抑郁'], output_path=output_path,
+                           chunksize=5, workers=1, dedupe_path=str(tmp_path / 'sig.sqlite'))
+
+    result = read_table(output_path)
+    assert list(result.columns) == ['question', 'answer']
+    assert result['question'].tolist() == [questions[i] for i in hit_rows]
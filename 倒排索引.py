@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+问答语料倒排索引
+功能：对question/answer列建立一次字符n-gram倒排索引并存为内存映射文件，
+     支持 AND/OR/NOT 与短语查询，新数据文件可增量追加，无需每次全量扫描Excel
+查询示例：抑郁 AND (失眠 OR 厌学) NOT 产后    "情绪低落"
+"""
+
+import json
+import os
+import re
+from array import array
+
+import numpy as np
+
+from NLP数据保留处理 import TEXT_COLUMNS, iter_chunks
+from 数据读写 import atomic_write, file_signature
+
+# ========== 用户配置 ==========
+SEGMENT_DOCS = 200000  # 每个索引段最多包含的文档数，决定建索引时的内存占用
+# ============================
+
+META_FILE = 'meta.json'
+SEGMENT_FILES = ('.postings', '.offsets', '.text', '.terms.json')  # 每个索引段的文件
+
+
+def _terms(text):
+    """索引词：单字与相邻二字"""
+    terms = set(text)
+    terms.update(text[i:i + 2] for i in range(len(text) - 1))
+    return terms
+
+
+def _query_terms(keyword):
+    """查询词拆成需要同时命中的n-gram，二字以上用二字组，单字用单字"""
+    if len(keyword) == 1:
+        return [keyword]
+    return [keyword[i:i + 2] for i in range(len(keyword) - 1)]
+
+
+class _SegmentBuilder:
+    """在内存中累积一个索引段，写盘后释放"""
+
+    def __init__(self, index_dir, name):
+        self.index_dir = index_dir
+        self.name = name
+        self.postings = {}
+        self.doc_count = 0
+        self._text_file = open(self._path('.text'), 'wb')
+        self._offsets = array('Q', [0])
+
+    def _path(self, suffix):
+        return os.path.join(self.index_dir, self.name + suffix)
+
+    def add(self, text):
+        doc_id = self.doc_count
+        for term in _terms(text):
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = array('I')
+            posting.append(doc_id)
+        data = text.encode('utf-8')
+        self._text_file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        self.doc_count += 1
+
+    def finish(self):
+        self._text_file.close()
+        with open(self._path('.offsets'), 'wb') as f:
+            self._offsets.tofile(f)
+        term_table = {}
+        offset = 0
+        with open(self._path('.postings'), 'wb') as f:
+            for term in sorted(self.postings):
+                posting = self.postings[term]
+                posting.tofile(f)
+                term_table[term] = [offset, len(posting)]
+                offset += len(posting)
+        with open(self._path('.terms.json'), 'w', encoding='utf-8') as f:
+            json.dump(term_table, f, ensure_ascii=False)
+        self.postings = {}
+
+
+class _Segment:
+    """只读索引段，倒排表、文本与偏移量均为内存映射"""
+
+    def __init__(self, index_dir, info):
+        self.info = info
+        path = os.path.join(index_dir, info['name'])
+        with open(path + '.terms.json', 'r', encoding='utf-8') as f:
+            self.terms = json.load(f)
+        self.doc_count = info['doc_count']
+        self.postings = self._memmap(path + '.postings', np.uint32)
+        self.offsets = self._memmap(path + '.offsets', np.uint64)
+        self.text = self._memmap(path + '.text', np.uint8)
+        self.all_docs = np.arange(self.doc_count, dtype=np.uint32)
+
+    @staticmethod
+    def _memmap(path, dtype):
+        # 空文件无法映射
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def posting(self, term):
+        entry = self.terms.get(term)
+        if entry is None:
+            return np.zeros(0, dtype=np.uint32)
+        offset, length = entry
+        return np.asarray(self.postings[offset:offset + length])
+
+    def doc_text(self, doc_id):
+        start, end = int(self.offsets[doc_id]), int(self.offsets[doc_id + 1])
+        return bytes(self.text[start:end]).decode('utf-8')
+
+    def match(self, keyword):
+        """n-gram倒排表求交得到候选，再回原文确认关键词连续出现"""
+        candidates = None
+        for term in _query_terms(keyword):
+            posting = self.posting(term)
+            candidates = posting if candidates is None else np.intersect1d(
+                candidates, posting, assume_unique=True)
+            if len(candidates) == 0:
+                return candidates
+        if len(keyword) <= 2:
+            return candidates
+        return np.array([doc for doc in candidates if keyword in self.doc_text(doc)],
+                        dtype=np.uint32)
+
+
+_TOKEN_PATTERN = re.compile(r'"([^"]*)"|(\()|(\))|([^\s()"]+)')
+
+
+def _tokenize_query(query):
+    tokens = []
+    for phrase, lparen, rparen, word in _TOKEN_PATTERN.findall(query):
+        if lparen or rparen:
+            tokens.append(('op', lparen or rparen))
+        elif word in ('AND', 'OR', 'NOT'):
+            tokens.append(('op', word))
+        elif word:
+            tokens.append(('term', word))
+        elif phrase:
+            tokens.append(('term', phrase))
+    return tokens
+
+
+class _QueryParser:
+    """
+    expr := and_expr (OR and_expr)*
+    and_expr := not_expr ([AND] not_expr)*   相邻词默认按AND处理
+    not_expr := NOT not_expr | '(' expr ')' | term
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _take(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        tree = self._expr()
+        if self._peek() is not None:
+            raise ValueError(f"查询语法错误：多余的 {self._peek()[1]}")
+        return tree
+
+    def _expr(self):
+        node = self._and_expr()
+        while self._peek() == ('op', 'OR'):
+            self._take()
+            node = ('OR', node, self._and_expr())
+        return node
+
+    def _and_expr(self):
+        node = self._not_expr()
+        while self._peek() is not None and self._peek() not in (('op', 'OR'), ('op', ')')):
+            if self._peek() == ('op', 'AND'):
+                self._take()
+            node = ('AND', node, self._not_expr())
+        return node
+
+    def _not_expr(self):
+        token = self._take()
+        if token is None:
+            raise ValueError("查询语法错误：表达式不完整")
+        if token == ('op', 'NOT'):
+            return ('NOT', self._not_expr())
+        if token == ('op', '('):
+            node = self._expr()
+            if self._take() != ('op', ')'):
+                raise ValueError("查询语法错误：括号不匹配")
+            return node
+        if token[0] == 'term':
+            return ('TERM', token[1])
+        raise ValueError(f"查询语法错误：意外的 {token[1]}")
+
+
+class InvertedIndex:
+    """磁盘倒排索引，查询返回全局文档编号，可用locate换算为（源文件, 行号）"""
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        os.makedirs(index_dir, exist_ok=True)
+        meta_path = os.path.join(index_dir, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {"columns": list(TEXT_COLUMNS), "sources": {}, "segments": [], "doc_count": 0}
+        self._segments = None
+
+    def _save_meta(self):
+        with atomic_write(os.path.join(self.index_dir, META_FILE)) as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=1)
+
+    @property
+    def segments(self):
+        if self._segments is None:
+            self._segments = [_Segment(self.index_dir, info) for info in self.meta['segments']
+                              if not info.get('deleted')]
+        return self._segments
+
+    def add_source(self, source_path, chunksize=20000):
+        """
+        增量加入一个数据文件；文件大小与修改时间未变则跳过，
+        文件有变化时旧段标记删除并重新建段（新文档编号接在末尾），元数据保存后删除旧段的文件
+        :return: 新增的文档数
+        """
+        source_path = os.path.abspath(source_path)
+        signature = file_signature(source_path)
+        if self.meta['sources'].get(source_path) == signature:
+            return 0
+        stale = []
+        for info in self.meta['segments']:
+            if info['source'] == source_path and not info.get('deleted'):
+                info['deleted'] = True
+                stale.append(info['name'])
+
+        added = 0
+        builder = None
+        row = 0
+        for chunk in iter_chunks(source_path, chunksize, columns=self.meta['columns'], dtype=str):
+            texts = chunk[self.meta['columns'][0]].fillna('').astype(str)
+            for col in self.meta['columns'][1:]:
+                texts = texts + '\n' + chunk[col].fillna('').astype(str)
+            for text in texts:
+                if builder is None:
+                    builder = self._new_segment(source_path, row)
+                builder.add(text)
+                row += 1
+                if builder.doc_count >= SEGMENT_DOCS:
+                    added += self._finish_segment(builder)
+                    builder = None
+        if builder is not None:
+            added += self._finish_segment(builder)
+
+        self.meta['sources'][source_path] = signature
+        self._save_meta()
+        # 元数据已不再引用旧段，先释放内存映射再删除其文件
+        self._segments = None
+        for name in stale:
+            for suffix in SEGMENT_FILES:
+                path = os.path.join(self.index_dir, name + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+        return added
+
+    def _new_segment(self, source_path, first_row):
+        name = f"seg_{len(self.meta['segments']):05d}"
+        builder = _SegmentBuilder(self.index_dir, name)
+        builder.info = {"name": name, "source": source_path, "first_row": first_row,
+                        "doc_start": self.meta['doc_count']}
+        return builder
+
+    def _finish_segment(self, builder):
+        builder.finish()
+        builder.info['doc_count'] = builder.doc_count
+        self.meta['segments'].append(builder.info)
+        self.meta['doc_count'] += builder.doc_count
+        return builder.doc_count
+
+    def search(self, query):
+        """执行布尔查询，返回升序的全局文档编号数组"""
+        tree = _QueryParser(_tokenize_query(query)).parse()
+        results = [self._evaluate(segment, tree).astype(np.int64) + segment.info['doc_start']
+                   for segment in self.segments]
+        return np.concatenate(results) if results else np.zeros(0, dtype=np.int64)
+
+    def _evaluate(self, segment, node):
+        kind = node[0]
+        if kind == 'TERM':
+            return segment.match(node[1])
+        if kind == 'NOT':
+            return np.setdiff1d(segment.all_docs, self._evaluate(segment, node[1]), assume_unique=True)
+        left = self._evaluate(segment, node[1])
+        right = self._evaluate(segment, node[2])
+        if kind == 'AND':
+            return np.intersect1d(left, right, assume_unique=True)
+        return np.union1d(left, right)
+
+    def _segment_of(self, doc_id):
+        for segment in self.segments:
+            start = segment.info['doc_start']
+            if start <= doc_id < start + segment.doc_count:
+                return segment, doc_id - start
+        raise KeyError(doc_id)
+
+    def locate(self, doc_id):
+        """全局文档编号 → (源文件, 数据行号，从0开始不含表头)"""
+        segment, local = self._segment_of(doc_id)
+        return segment.info['source'], segment.info['first_row'] + local
+
+    def text(self, doc_id):
+        segment, local = self._segment_of(doc_id)
+        return segment.doc_text(local)
+
+
+def build_index(index_dir, source_paths):
+    """建立或增量更新索引"""
+    index = InvertedIndex(index_dir)
+    for path in source_paths:
+        added = index.add_source(path)
+        if added:
+            print(f"已索引: {path}（{added} 条）")
+        else:
+            print(f"未变化，跳过: {path}")
+    print(f"索引共 {sum(s.doc_count for s in index.segments)} 条文档，目录: {os.path.abspath(index_dir)}")
+    return index
+
+
+if __name__ == "__main__":
+    # 路径配置
+    index_dir = r"D:\统计建模\cMedQA-master\QA索引"
+    source_files = [r"D:\统计建模\cMedQA-master\answers.csv\QA1.xlsx"]
+
+    index = build_index(index_dir, source_files)
+
+    # 交互式关键词探索
+    while True:
+        query = input("\n查询（回车退出）: ").strip()
+        if not query:
+            break
+        try:
+            doc_ids = index.search(query)
+        except ValueError as e:
+            print(e)
+            continue
+        print(f"命中 {len(doc_ids)} 条")
+        for doc_id in doc_ids[:10]:
+            source, row = index.locate(int(doc_id))
+            print(f"[{os.path.basename(source)} 第{row + 1}行] {index.text(int(doc_id))[:60]}")
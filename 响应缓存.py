@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+API响应缓存
+功能：以请求内容的哈希为键，把API返回结果持久化到本地SQLite，重跑时直接命中
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from 运行指标 import metrics
+
+class ResponseCache:
+    """
+    基于SQLite的内容寻址缓存（线程安全）
+    :param path: 缓存数据库路径
+    :param max_bytes: 缓存总大小上限，超出时按最近访问时间淘汰
+    :param max_age: 条目最长保留秒数，None表示不过期
+    :param enabled: False时不读不写，相当于绕过缓存
+    """
+
+    def __init__(self, path="llm_cache.sqlite", max_bytes=512 * 1024 * 1024, max_age=None,
+                 enabled=True):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if enabled:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON cache(accessed)")
+            self._conn.commit()
+            self._total_bytes = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    @staticmethod
+    def make_key(*parts):
+        """由模型、温度、系统提示词、用户文本等组成缓存键"""
+        payload = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """命中返回缓存的字符串，未命中或已过期返回None"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created, size FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.max_age is not None and now - row[1] > self.max_age:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self._total_bytes -= row[2]
+                row = None
+            if row is None:
+                self.misses += 1
+                metrics.incr('cache_misses', cache=os.path.basename(self.path))
+                return None
+            self._conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            metrics.incr('cache_hits', cache=os.path.basename(self.path))
+            return row[0]
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self._total_bytes -= old[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self._total_bytes += size
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """删除过期条目，并按最近访问时间淘汰到大小上限以内"""
+        if self.max_age is not None:
+            cutoff = time.time() - self.max_age
+            expired = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache WHERE created < ?", (cutoff,)).fetchone()[0]
+            if expired:
+                self._conn.execute("DELETE FROM cache WHERE created < ?", (cutoff,))
+                self._total_bytes -= expired
+        if self.max_bytes is None or self._total_bytes <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+                "SELECT key, size FROM cache ORDER BY accessed").fetchall():
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._total_bytes -= size
+            if self._total_bytes <= self.max_bytes:
+                break
+
+    def stats(self):
+        """返回命中/未命中次数与命中率"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
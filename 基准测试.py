@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+离线基准测试
+功能：在本机启动两个替身服务——OpenAI兼容的对话接口与百度翻译兼容接口，
+     延迟分布、错误率和限流阈值均可配置；用合成语料分别运行 分类、病例生成、翻译 三条流程，
+     报告 行/秒、p50/p95/p99 延迟、重试次数与内存峰值，结果追加到记录文件并与上次结果对比，
+     不消耗真实API额度即可发现性能退化
+用法：python 基准测试.py [分类] [生成] [翻译]
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+import 英文自动化翻译 as translation
+from 学生化过滤 import DeepSeekClassifier
+from 数据读写 import read_table, write_table
+from 自动病例数据生成 import DepressionDataGenerator
+
+# ========== 用户配置 ==========
+ROWS = 200  # 每个场景的合成语料行数（生成场景为目标记录数）
+CHAT_LATENCY_MS = 300  # 对话接口延迟中位数（毫秒），按对数正态分布抖动
+TRANSLATE_LATENCY_MS = 150  # 翻译接口延迟中位数（毫秒）
+LATENCY_SIGMA = 0.5  # 对数正态分布的sigma，越大长尾越重
+ERROR_RATE = 0.02  # 随机返回服务端错误的比例
+THROTTLE_RPS = 20  # 服务端每秒放行的请求数，超出返回限流；0为不限流
+MAX_WORKERS = 8  # 分类与生成场景的并发数
+BATCH_SIZE = 4  # 分类场景每个请求打包的记录数
+RESULTS_FILE = 'benchmark_results.jsonl'  # 历次结果记录
+REGRESSION_TOLERANCE = 0.2  # 行/秒比上次同配置结果下降超过该比例时提示退化
+VERBOSE = False  # 是否显示各流程自身的输出
+# ============================
+
+
+class ServerProfile:
+    """替身服务的行为配置"""
+
+    def __init__(self, latency_ms, sigma=LATENCY_SIGMA, error_rate=ERROR_RATE,
+                 throttle_rps=THROTTLE_RPS, seed=0):
+        self.latency_ms = latency_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.throttle_rps = throttle_rps
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(latency_ms=self.latency_ms, sigma=self.sigma, error_rate=self.error_rate,
+                    throttle_rps=self.throttle_rps)
+
+
+class _MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, profile):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.profile = profile
+        self.random = random.Random(profile.seed)
+        self.lock = threading.Lock()
+        self.window = deque()  # 最近1秒内放行请求的时间戳
+        self.seen = set()
+        self.stats = dict(requests=0, retries=0, errors=0, throttled=0)
+
+    def admit(self, retry):
+        """
+        登记一个请求并决定其结果：'ok'、'throttled' 或 'error'
+        :param retry: 客户端标明或可识别的重试请求
+        """
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['retries'] += int(retry)
+            now = time.monotonic()
+            while self.window and now - self.window[0] > 1.0:
+                self.window.popleft()
+            if self.profile.throttle_rps and len(self.window) >= self.profile.throttle_rps:
+                self.stats['throttled'] += 1
+                return 'throttled'
+            self.window.append(now)
+            if self.random.random() < self.profile.error_rate:
+                self.stats['errors'] += 1
+                return 'error'
+            delay = self.profile.latency_ms / 1000 * self.random.lognormvariate(0, self.profile.sigma)
+        time.sleep(delay)
+        return 'ok'
+
+    def is_repeat(self, key):
+        with self.lock:
+            if key in self.seen:
+                return True
+            self.seen.add(key)
+            return False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_BATCH_ID = re.compile(r'【编号:(\d+)】')
+
+
+def _classification(rng):
+    passed = rng.random() < 0.6
+    return {"age_pass": passed, "symptom_match": passed, "exclusion_pass": True,
+            "is_depression": passed, "confidence": rng.randint(80, 100) if passed else 0,
+            "reason": "基准测试"}
+
+
+def _chat_content(messages, rng):
+    """按请求内容返回分类结果（单条或批量）或生成的病例"""
+    user = messages[-1]['content']
+    if user == "生成案例":
+        cases = [{"question": f"孩子{rng.randint(12, 18)}岁{rng.random():.8f}号同学近期失眠厌学",
+                  "answer": f"疑似抑郁{rng.random():.8f}，建议就医并每日倾听二十分钟",
+                  "reason": "基准测试"} for _ in range(3)]
+        return json.dumps({"cases": cases}, ensure_ascii=False)
+    ids = _BATCH_ID.findall(user)
+    if ids:
+        return json.dumps({"results": [dict(_classification(rng), id=int(i)) for i in ids]},
+                          ensure_ascii=False)
+    return json.dumps(_classification(rng), ensure_ascii=False)
+
+
+class ChatHandler(_Handler):
+    """OpenAI兼容的 /chat/completions"""
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        # openai SDK在重试时带上重试次数
+        retry = int(self.headers.get('x-stainless-retry-count', '0') or 0) > 0
+        outcome = self.server.admit(retry)
+        if outcome == 'throttled':
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                            {'retry-after-ms': '200'})
+            return
+        if outcome == 'error':
+            self._send_json(500, {"error": {"message": "Internal error", "type": "server_error"}})
+            return
+        with self.server.lock:
+            content = _chat_content(request.get('messages', [{}]), self.server.random)
+        prompt_tokens = sum(len(m.get('content', '')) for m in request.get('messages', []))
+        self._send_json(200, {
+            "id": f"bench-{time.monotonic_ns()}", "object": "chat.completion",
+            "created": int(time.time()), "model": request.get('model', 'bench'),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content),
+                      "total_tokens": prompt_tokens + len(content)},
+        })
+
+
+class TranslateHandler(_Handler):
+    """百度翻译兼容接口：限流返回54003，随机错误返回52002（均为客户端应重试的错误码）"""
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        q = query.get('q', [''])[0]
+        # 原文相同的请求只可能是重试（流程内已去重）
+        outcome = self.server.admit(self.server.is_repeat(q))
+        if outcome == 'throttled':
+            self._send_json(200, {"error_code": "54003", "error_msg": "Invalid Access Limit"})
+            return
+        if outcome == 'error':
+            self._send_json(200, {"error_code": "52002", "error_msg": "SYSTEM ERROR"})
+            return
+        self._send_json(200, {"from": "en", "to": "zh", "trans_result": [
+            {"src": segment, "dst": f"译文：{segment}"} for segment in q.split('\n')]})
+
+
+@contextlib.contextmanager
+def mock_server(handler, profile):
+    """启动替身服务，产出 (服务对象, 根地址)"""
+    server = _MockServer(handler, profile)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class LatencyRecorder:
+    """包装被测调用，记录每次调用的耗时"""
+
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def wrap(self, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.samples.append(time.perf_counter() - start)
+        return wrapper
+
+    def percentiles(self):
+        if not self.samples:
+            return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+        p50, p95, p99 = np.percentile(np.array(self.samples) * 1000, [50, 95, 99])
+        return {"p50_ms": round(float(p50), 1), "p95_ms": round(float(p95), 1),
+                "p99_ms": round(float(p99), 1)}
+
+
+def synthetic_qa(rows, seed=0):
+    """合成问答语料：约一半带6-18岁年龄特征，其余会被本地预筛拒绝"""
+    rng = random.Random(seed)
+    symptoms = ['失眠', '厌学', '情绪低落', '自残', '暴食', '社交回避', '兴趣丧失']
+    data = []
+    for i in range(rows):
+        age = rng.choice([rng.randint(6, 18), rng.randint(25, 60)])
+        picked = '、'.join(rng.sample(symptoms, 2))
+        data.append({"question": f"患者{age}岁，近{rng.randint(2, 8)}周{picked}，编号{i}",
+                     "answer": f"考虑抑郁可能，建议{rng.choice(['心理咨询', '药物治疗', '家庭干预'])}"})
+    return pd.DataFrame(data)
+
+
+def synthetic_comments(rows, seed=0):
+    """合成英文评论，约10%与前文重复，用于检验去重与翻译记忆"""
+    rng = random.Random(seed)
+    words = ['feel', 'sad', 'tired', 'school', 'sleep', 'alone', 'happy', 'stress', 'family',
+             'friends', 'hopeless', 'better', 'today', 'never', 'always', 'worried']
+    comments = []
+    for _ in range(rows):
+        if comments and rng.random() < 0.1:
+            comments.append(rng.choice(comments))
+        else:
+            comments.append(' '.join(rng.choice(words) for _ in range(rng.randint(6, 20))))
+    return pd.DataFrame({"Comment": comments})
+
+
+def bench_classifier(rows, base_url, work_dir):
+    input_path = os.path.join(work_dir, 'qa.parquet')
+    write_table(synthetic_qa(rows), input_path)
+    classifier = DeepSeekClassifier(api_key='bench', cache_path=os.path.join(work_dir, 'cache.sqlite'),
+                                    use_cache=False, base_url=base_url)
+    recorder = LatencyRecorder()
+    completions = classifier.client.chat.completions
+    completions.create = recorder.wrap(completions.create)
+    classifier.process_excel(input_path, os.path.join(work_dir, 'classified.parquet'),
+                             max_workers=MAX_WORKERS, requests_per_second=1000, batch_size=BATCH_SIZE)
+    return rows, recorder
+
+
+def bench_generator(rows, base_url, work_dir):
+    generator = DepressionDataGenerator('bench', base_url=base_url,
+                                        dedupe_path=os.path.join(work_dir, 'signatures.sqlite'))
+    recorder = LatencyRecorder()
+    completions = generator.client.chat.completions
+    completions.create = recorder.wrap(completions.create)
+    output_path = os.path.join(work_dir, 'generated.xlsx')
+    generator.generate_data(rows, output_path, max_workers=MAX_WORKERS, requests_per_second=1000)
+    generator.dedupe.close()
+    return (len(read_table(output_path)) if os.path.exists(output_path) else 0), recorder
+
+
+def bench_translator(rows, base_url, work_dir):
+    input_path = os.path.join(work_dir, 'comments.parquet')
+    write_table(synthetic_comments(rows), input_path)
+    recorder = LatencyRecorder()
+    original = translation.BaiduTranslator._request
+    translation.BaiduTranslator._request = recorder.wrap(original)
+    try:
+        translation.process_with_autosave(
+            'bench', 'bench', input_file=input_path,
+            output_file=os.path.join(work_dir, 'translated.parquet'),
+            checkpoint_file=os.path.join(work_dir, 'checkpoint.jsonl'),
+            memory_file=os.path.join(work_dir, 'memory.sqlite'), api_url=base_url + '/translate')
+    finally:
+        translation.BaiduTranslator._request = original
+    return rows, recorder
+
+
+SCENARIOS = {
+    '分类': (bench_classifier, ChatHandler, CHAT_LATENCY_MS),
+    '生成': (bench_generator, ChatHandler, CHAT_LATENCY_MS),
+    '翻译': (bench_translator, TranslateHandler, TRANSLATE_LATENCY_MS),
+}
+
+
+def _run_bench(bench, handler, profile, rows, trace_memory=False):
+    """在全新的临时目录和替身服务中运行一次，返回 (处理行数, 耗时记录, 耗时, 服务统计, 内存峰值)"""
+    output = io.StringIO()
+    with tempfile.TemporaryDirectory() as work_dir, mock_server(handler, profile) as (server, base_url):
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            if VERBOSE:
+                processed, recorder = bench(rows, base_url, work_dir)
+            else:
+                with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                    processed, recorder = bench(rows, base_url, work_dir)
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = 0
+            if trace_memory:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+        return processed, recorder, elapsed, dict(server.stats), peak
+
+
+def run_scenario(name, rows=ROWS):
+    """
+    运行一个场景并返回指标
+    tracemalloc会显著拖慢纯Python代码，吞吐与延迟在不追踪内存的一轮中测量，内存峰值另跑一轮测量
+    """
+    bench, handler, latency_ms = SCENARIOS[name]
+    profile = ServerProfile(latency_ms)
+    processed, recorder, elapsed, stats, _ = _run_bench(bench, handler, profile, rows)
+    *_, peak = _run_bench(bench, handler, profile, rows, trace_memory=True)
+    return {"scenario": name, "rows": processed, "seconds": round(elapsed, 2),
+            "rows_per_sec": round(processed / elapsed, 2) if elapsed else None,
+            "calls": len(recorder.samples), **recorder.percentiles(), **stats,
+            "peak_mb": round(peak / 1024 / 1024, 1), "profile": profile.as_dict()}
+
+
+def _previous(name, rows, profile):
+    """记录文件中同场景、同规模、同服务配置的上一次结果"""
+    if not os.path.exists(RESULTS_FILE):
+        return None
+    previous = None
+    with open(RESULTS_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if (record.get('scenario'), record.get('target_rows'), record.get('profile')) == (name, rows, profile):
+                previous = record
+    return previous
+
+
+def run_benchmarks(names=None, rows=ROWS):
+    results = []
+    for name in names or SCENARIOS:
+        print(f"运行场景: {name}（{rows} 行）...")
+        result = run_scenario(name, rows)
+        previous = _previous(name, rows, result['profile'])
+        result['target_rows'] = rows
+        result['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        with open(RESULTS_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(result, ensure_ascii=False) + '\n')
+        if previous and previous.get('rows_per_sec') and result['rows_per_sec'] is not None:
+            change = result['rows_per_sec'] / previous['rows_per_sec'] - 1
+            result['change'] = change
+            if change < -REGRESSION_TOLERANCE:
+                print(f"  ⚠ 性能退化：行/秒 {previous['rows_per_sec']} → {result['rows_per_sec']}（{change:+.0%}）")
+        results.append(result)
+
+    print(f"\n{'场景':<6}{'行数':>6}{'行/秒':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'请求':>6}"
+          f"{'重试':>6}{'错误':>6}{'限流':>6}{'内存MB':>8}{'对比上次':>10}")
+    for r in results:
+        change = f"{r['change']:+.0%}" if 'change' in r else '-'
+        print(f"{r['scenario']:<6}{r['rows']:>6}{r['rows_per_sec']:>9}{r['p50_ms'] or '-':>8}"
+              f"{r['p95_ms'] or '-':>8}{r['p99_ms'] or '-':>8}{r['requests']:>6}{r['retries']:>6}"
+              f"{r['errors']:>6}{r['throttled']:>6}{r['peak_mb']:>8}{change:>10}")
+    return results
+
+
+if __name__ == "__main__":
+    run_benchmarks(sys.argv[1:] or None)
@@ -5,16 +5,46 @@
 
 import pandas as pd
 from openai import OpenAI
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 import json
+import hashlib
+import re
+from 限流工具 import TokenBucket
+from 响应缓存 import ResponseCache
+from 结果日志 import ResultJournal
+from 数据读写 import read_table, table_columns, write_table
+from 运行指标 import metrics, run_metrics
+
+# 这些结果不写入日志，续跑时会重新请求
+FAILED_REASONS = ("API错误", "解析错误")
+# 中途出错时尚未得到结果的行
+UNFINISHED_REASON = "未处理"
+# 单条文本截断长度，与批量打包的字符预算保持一致
+TEXT_LIMIT = 2000
+# 批量模式下每个请求的用户文本字符预算（约4条满长度记录）
+BATCH_CHAR_BUDGET = 4 * TEXT_LIMIT
+
+# ========== 本地年龄预筛规则（对应提示词第一步） ==========
+AGE_PATTERN = re.compile(r'(\d{1,3})\s*(?:周岁|岁)')
+CN_AGE_PATTERN = re.compile(r'(?<![一二三四五六七八九十两百])(?:六|七|八|九|十[一二三四五六七八]?)(?:周岁|岁)')
+EDUCATION_PATTERN = re.compile(r'小学|初中|高中|中学|初[一二三]|高[一二三]|[一二三四五六]年级|中考|高考')
+STUDENT_PATTERN = re.compile(r'学生|同学|老师|学校|家长会|班主任|上学|放学|逃学|休学|作业|考试')
+EXCLUSION_PATTERN = re.compile(r'新生儿|幼儿园|大学生|研究生|婴儿|阿尔茨海默')
+PRESCREEN_RESULT = {"age_pass": False, "is_depression": False, "confidence": 0,
+                    "reason": "本地预筛：年龄不符"}
 
 class DeepSeekClassifier:
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, cache_path="llm_cache.sqlite", use_cache=True,
+                 base_url="https://api.deepseek.com"):
         self.client = OpenAI(
             api_key=api_key or os.getenv("DEEPSEEK_API_KEY"),
-            base_url="https://api.deepseek.com"
+            base_url=base_url
         )
+        self.model = "deepseek-chat"
+        self.temperature = 0.3
+        # 相同模型+温度+提示词+文本的结果直接复用，use_cache=False时绕过
+        self.cache = ResponseCache(cache_path, enabled=use_cache)
 
         self.system_prompt = """你是一个心理分析专家，根据以下规则判断是否属于青少年（6-18岁）抑郁问题：
 青少年抑郁判定专家规则（三步验证流程）
@@ -55,63 +85,279 @@ class DeepSeekClassifier:
 
 }"""
 
-    def _call_api(self, text):
+        # 批量模式在同一份规则后追加多记录输出格式，规则前缀保持不变
+        self.batch_prompt = self.system_prompt + """
+## 批量模式
+用户消息包含多条记录，每条以"【编号:N】"开头。请按上述规则逐条独立判断，返回严格JSON格式：
+{"results": [{"id": 编号, "age_pass": bool, "symptom_match": bool, "exclusion_pass": bool,
+"is_depression": bool, "confidence": 0-100, "reason": "判断依据简述"}, ...]}
+每个编号必须且只能出现一次。"""
+
+    def _call_api(self, text, rate_limiter=None):
+        """单条请求；命中缓存时不消耗令牌"""
+        text = text[:TEXT_LIMIT]
+        cache_key = ResponseCache.make_key(self.model, self.temperature, self.system_prompt, text)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return json.loads(cached)
+
+        if rate_limiter is not None:
+            rate_limiter.acquire()
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": text[:2000]}
-                ],
-                temperature=0.3,
-                response_format={"type": "json_object"}
-            )
+            with metrics.timer('api_call', script='分类', mode='single'):
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": self.system_prompt},
+                        {"role": "user", "content": text}
+                    ],
+                    temperature=self.temperature,
+                    response_format={"type": "json_object"}
+                )
+            metrics.record_usage(response, script='分类')
 
             result_str = response.choices[0].message.content
             try:
-                return json.loads(result_str)
+                with metrics.timer('json_parse', script='分类'):
+                    result = json.loads(result_str)
             except Exception as e:
+                metrics.incr('parse_failures', script='分类')
                 print(f"JSON解析失败: {str(e)} 原始返回：{result_str}")
                 return {"is_depression": False, "confidence": 0, "reason": "解析错误"}
+            # 只缓存解析成功的结果，失败的行重跑时会重新请求
+            self.cache.set(cache_key, result_str)
+            return result
 
         except Exception as e:
+            metrics.incr('api_errors', script='分类')
             print(f"API调用错误: {str(e)}")
             return {"is_depression": False, "confidence": 0, "reason": "API错误"}
 
-    def process_excel(self, input_path, output_path):
+    def _call_api_batch(self, items, rate_limiter=None):
+        """
+        把多条记录打包进一次请求，返回 {编号: 结果}
+        缺失、重复或解析失败的编号自动回退为单条请求；只有真正发出请求时才消耗令牌
+        :param items: [(编号, 文本), ...]
+        """
+        results = {}
+        todo = []
+        for item_id, text in items:
+            text = text[:TEXT_LIMIT]
+            cached = self.cache.get(ResponseCache.make_key(
+                self.model, self.temperature, self.batch_prompt, text))
+            if cached is not None:
+                results[item_id] = json.loads(cached)
+            else:
+                todo.append((item_id, text))
+
+        if todo:
+            user_text = "\n\n".join(f"【编号:{item_id}】\n{text}" for item_id, text in todo)
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            try:
+                with metrics.timer('api_call', script='分类', mode='batch'):
+                    response = self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": self.batch_prompt},
+                            {"role": "user", "content": user_text}
+                        ],
+                        temperature=self.temperature,
+                        response_format={"type": "json_object"}
+                    )
+                metrics.record_usage(response, script='分类')
+                with metrics.timer('json_parse', script='分类'):
+                    batch_results = self._parse_batch(response.choices[0].message.content,
+                                                      {item_id for item_id, _ in todo})
+            except Exception as e:
+                metrics.incr('api_errors', script='分类')
+                print(f"批量API调用错误: {str(e)}")
+                batch_results = {}
+
+            for item_id, text in todo:
+                result = batch_results.get(item_id)
+                if result is not None:
+                    self.cache.set(ResponseCache.make_key(
+                        self.model, self.temperature, self.batch_prompt, text),
+                        json.dumps(result, ensure_ascii=False))
+                else:
+                    result = self._call_api(text, rate_limiter)
+                results[item_id] = result
+        return results
+
+    @staticmethod
+    def _parse_batch(result_str, expected_ids):
+        """校验批量返回，只保留编号合法且字段完整的结果"""
         try:
-            df = pd.read_excel(input_path)
+            entries = json.loads(result_str).get("results", [])
+        except Exception as e:
+            metrics.incr('parse_failures', script='分类')
+            print(f"批量JSON解析失败: {str(e)} 原始返回：{result_str}")
+            return {}
+        parsed = {}
+        for entry in entries if isinstance(entries, list) else []:
+            if not isinstance(entry, dict) or 'is_depression' not in entry:
+                continue
+            try:
+                item_id = int(entry.pop('id'))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if item_id in expected_ids and item_id not in parsed:
+                parsed[item_id] = entry
+        missing = len(expected_ids) - len(parsed)
+        if missing:
+            metrics.incr('batch_fallbacks', missing, script='分类')
+            print(f"批量返回缺少 {missing} 条，改为逐条请求")
+        return parsed
+
+    @staticmethod
+    def _make_batches(pending, batch_size, char_budget=BATCH_CHAR_BUDGET):
+        """按条数上限和截断后的字符预算把待处理行分组"""
+        batches, batch, chars = [], [], 0
+        for item in pending:
+            length = min(len(item[1]), TEXT_LIMIT)
+            if batch and (len(batch) >= batch_size or chars + length > char_budget):
+                batches.append(batch)
+                batch, chars = [], 0
+            batch.append(item)
+            chars += length
+        if batch:
+            batches.append(batch)
+        return batches
 
-            question_col = df.columns[0]
-            answer_col = df.columns[1]
+    def _classify_batch(self, batch, rate_limiter):
+        """调用API前才取令牌，保证并发下的总请求速率，缓存命中不限速；返回 [(行信息, 结果), ...]"""
+        if len(batch) == 1:
+            return [(batch[0], self._call_api(batch[0][1], rate_limiter))]
+        results = self._call_api_batch([(int(index), text) for index, text, _ in batch], rate_limiter)
+        return [(item, results[int(item[0])]) for item in batch]
+
+    @staticmethod
+    def _prescreen(texts):
+        """
+        向量化年龄预筛，返回布尔Series：True表示无任何6-18岁年龄特征，可直接判为不通过
+        排除词（如"大学生"）先从文本中去掉，避免其中的"学生"被当作学生特征
+        """
+        ages = texts.str.extractall(AGE_PATTERN)[0].astype(int)
+        age_in_range = ages.between(6, 18).groupby(level=0).any()
+        age_in_range = age_in_range.reindex(texts.index, fill_value=False)
+        cleaned = texts.str.replace(EXCLUSION_PATTERN, '', regex=True)
+        has_signal = (age_in_range
+                      | texts.str.contains(CN_AGE_PATTERN)
+                      | cleaned.str.contains(EDUCATION_PATTERN)
+                      | cleaned.str.contains(STUDENT_PATTERN))
+        return ~has_signal
+
+    def process_excel(self, input_path, output_path, max_workers=4, requests_per_second=2.0,
+                      preserve_order=True, journal_path=None, batch_size=1, prescreen=True,
+                      audit_rate=0.0):
+        """
+        并发分类问答数据，输入输出按扩展名支持xlsx/csv/Parquet/Feather
+        前两列为问题与回答，输出为输入的全部列加分类结果
+        :param max_workers: 同时在途的请求数
+        :param requests_per_second: 令牌桶限速（每秒请求数）
+        :param preserve_order: True时按行号顺序回收结果，False时按完成顺序回收
+        :param journal_path: 逐行结果日志路径，默认与输出文件同目录；重启时从日志续跑
+        :param batch_size: 每个请求打包的记录数，大于1时共用一次系统提示词
+        :param prescreen: 是否先用本地规则筛掉明显不满足年龄条件的行
+        :param audit_rate: 被预筛拒绝的行中抽样送API复核的比例，用于检验预筛精度
+        """
+        journal_path = journal_path or os.path.splitext(output_path)[0] + "_journal.jsonl"
+        journal = ResultJournal(journal_path)
+        try:
+            # 输出保留输入的全部列；前两列为问题与回答，按文本读取
+            question_col, answer_col = table_columns(input_path)[:2]
+            df = read_table(input_path, dtype={question_col: str, answer_col: str})
 
             df.insert(2, 'is_depression', False)
             df.insert(3, 'confidence', 0)
-            df.insert(4, 'reason', '')
+            df.insert(4, 'reason', UNFINISHED_REASON)
 
+            # 日志中文本哈希一致的行视为已完成，直接回填
+            finished_rows = journal.load()
+            pending = []
             for index, row in df.iterrows():
                 combined_text = f"问题描述：{row[question_col]}\n医师回答：{row[answer_col]}"
+                text_key = hashlib.sha1(combined_text.encode('utf-8')).hexdigest()
+                record = finished_rows.get(int(index))
+                if record is not None and record['key'] == text_key:
+                    self._fill_row(df, index, record['result'])
+                else:
+                    pending.append((index, combined_text, text_key))
+            if finished_rows:
+                print(f"从日志恢复 {len(df) - len(pending)} 条结果，剩余 {len(pending)} 条")
+
+            audit_indices = set()
+            if prescreen and pending:
+                texts = pd.Series([text for _, text, _ in pending],
+                                  index=[index for index, _, _ in pending])
+                rejected = texts[self._prescreen(texts)]
+                if audit_rate > 0 and len(rejected):
+                    audit_indices = set(rejected.sample(frac=audit_rate, random_state=0).index)
+                remaining = []
+                for item in pending:
+                    index, _, text_key = item
+                    if index in rejected.index and index not in audit_indices:
+                        result = dict(PRESCREEN_RESULT)
+                        self._fill_row(df, index, result)
+                        journal.append({"index": int(index), "key": text_key, "result": result})
+                    else:
+                        remaining.append(item)
+                print(f"本地预筛拒绝 {len(rejected)} 条，节省API调用 {len(pending) - len(remaining)} 次，"
+                      f"抽样复核 {len(audit_indices)} 条")
+                pending = remaining
+            audit_checked = audit_agree = 0
 
-                result = self._call_api(combined_text)
+            rate_limiter = TokenBucket(requests_per_second)
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+            try:
+                futures = [executor.submit(self._classify_batch, batch, rate_limiter)
+                           for batch in self._make_batches(pending, batch_size)]
 
-                df.at[index, 'is_depression'] = result.get('is_depression', False)
-                df.at[index, 'confidence'] = result.get('confidence', 0)
-                df.at[index, 'reason'] = result.get('reason', 'error')[:20]
+                # 结果按行号写回，与完成顺序无关
+                finished = futures if preserve_order else as_completed(futures)
+                done = 0
+                for future in finished:
+                    for (index, _, text_key), result in future.result():
+                        self._fill_row(df, index, result)
+                        if result.get('reason') not in FAILED_REASONS:
+                            journal.append({"index": int(index), "key": text_key, "result": result})
+                        # 只统计明确给出age_pass的结果，缺字段时无法判断是否同意年龄预筛
+                        if (index in audit_indices and result.get('reason') not in FAILED_REASONS
+                                and 'age_pass' in result):
+                            audit_checked += 1
+                            if not result['age_pass']:
+                                audit_agree += 1
 
-                if index % 3 == 0:
-                    df.to_excel(output_path, index=False)
-                    print(f"进度: {index+1}/{len(df)} | 当前置信度: {result['confidence']} | 理由: {result['reason']}")
+                        done += 1
+                        if done % 3 == 0:
+                            print(f"进度: {done}/{len(pending)} | 当前置信度: {result.get('confidence', 0)} | 理由: {result.get('reason', '')}")
+            finally:
+                # 中断时取消尚未开始的请求
+                executor.shutdown(cancel_futures=True)
 
-                time.sleep(0.5)
+            if audit_checked:
+                print(f"预筛复核：API同样判定年龄不符 {audit_agree}/{audit_checked}，"
+                      f"精度 {audit_agree / audit_checked:.1%}")
 
         except Exception as e:
             print(f"处理过程中发生错误: {str(e)}")
         finally:
-            df.to_excel(output_path, index=False)
+            journal.close()
+            # 只在结束时写一次结果，中途进度由日志保证
+            write_table(df, output_path)
             print(f"最终结果已保存至: {output_path}")
+            stats = self.cache.stats()
+            print(f"缓存命中: {stats['hits']} | 未命中: {stats['misses']} | 命中率: {stats['hit_rate']:.1%}")
 
         return df
 
+    @staticmethod
+    def _fill_row(df, index, result):
+        df.at[index, 'is_depression'] = result.get('is_depression', False)
+        df.at[index, 'confidence'] = result.get('confidence', 0)
+        df.at[index, 'reason'] = result.get('reason', 'error')[:20]
+
 if __name__ == "__main__":
     api_key = input("请在此粘贴您的DeepSeek API密钥（输入后回车）: ").strip()
     while not api_key:
@@ -120,9 +366,11 @@ if __name__ == "__main__":
 
     classifier = DeepSeekClassifier(api_key=api_key)
 
-    input_file = r"D:\统计建模\初步处理后的包含抑郁字样的数据\病例数据\儿科抑郁数据_filtered.xlsx"
+    input_file = r"D:\统计建模\初步处理后的包含抑郁字样的数据\病例数据\儿科抑郁数据_filtered.parquet"
     output_file = r"D:\统计建模\初步处理后的包含抑郁字样的数据\病例数据\儿科抑郁数据_学生阶段.xlsx"
 
     print("\n开始处理，请勿关闭程序...")
-    classifier.process_excel(input_file, output_file)
+    # 结束时导出 metrics.jsonl / metrics.prom；设置环境变量 METRICS_PROFILE=1 可同时采样调用栈
+    with run_metrics('分类'):
+        classifier.process_excel(input_file, output_file, batch_size=4)
     print("\n处理完成！建议人工校验前10条数据的分类结果")
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+数字数据特征分析
+功能：把按受试者存放的活动量时间序列CSV（condition_*.csv 抑郁组、control_*.csv 对照组）
+     一次性导入内存映射列存储，之后按受试者并行提取日/小时聚合、变异性与自相关特征，
+     并计算特征与标签（分组、量表分）的相关矩阵；任何时候只有单个受试者的序列在内存中
+"""
+
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from CSV转换工具 import detect_encoding
+from 数据读写 import atomic_write, file_signature
+
+# ========== 用户配置 ==========
+TIME_COLUMN = 'timestamp'  # 时间列
+VALUE_COLUMN = 'activity'  # 数值列
+SCORES_FILE = 'scores.csv'  # 受试者标签表（可选），按 number 列与受试者编号对应
+CHUNK_SIZE = 200000  # 导入时每块读取的行数
+# ============================
+
+META_FILE = 'meta.json'
+SUBJECT_PATTERN = re.compile(r'^(condition|control)_(\d+)\.csv$', re.IGNORECASE)
+COLUMNS = {'time': np.int64, 'value': np.float32}  # 列名 → 存储类型，时间为Unix秒
+
+
+def _column_path(store_dir, subject, column):
+    return os.path.join(store_dir, f"{subject}.{column}.bin")
+
+
+def _ingest_subject(input_path, store_dir, subject, chunksize=CHUNK_SIZE):
+    """
+    把单个受试者的CSV分块追加写入各列的二进制文件（可在子进程中执行）
+    :return: 写入的行数（不含时间无效的行）
+    """
+    encoding = detect_encoding(input_path)
+    rows = 0
+    temp_paths = {column: _column_path(store_dir, subject, column) + '.tmp' for column in COLUMNS}
+    files = {column: open(path, 'wb') for column, path in temp_paths.items()}
+    try:
+        for chunk in pd.read_csv(input_path, encoding=encoding, chunksize=chunksize,
+                                 usecols=[TIME_COLUMN, VALUE_COLUMN]):
+            times = pd.to_datetime(chunk[TIME_COLUMN], errors='coerce')
+            # 时间为空或无法解析的行连同数值一起丢弃，否则NaT会变成int64最小值
+            parsed = times.notna().to_numpy()
+            seconds = times[parsed].to_numpy('datetime64[s]').astype(np.int64)
+            values = pd.to_numeric(chunk[VALUE_COLUMN], errors='coerce').to_numpy(np.float32)[parsed]
+            seconds.tofile(files['time'])
+            values.tofile(files['value'])
+            rows += len(seconds)
+    finally:
+        for f in files.values():
+            f.close()
+    for column, path in temp_paths.items():
+        os.replace(path, _column_path(store_dir, subject, column))
+    return rows
+
+
+class SeriesStore:
+    """
+    受试者时间序列的列存储：每个受试者每列一个定长二进制文件，读取时内存映射
+    meta.json 记录受试者分组、行数与源文件大小/修改时间，源文件未变时不重复导入
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        meta_path = os.path.join(store_dir, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {"subjects": {}}
+
+    def _save_meta(self):
+        with atomic_write(os.path.join(self.store_dir, META_FILE)) as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=1)
+
+    @property
+    def subjects(self):
+        return sorted(self.meta['subjects'])
+
+    def info(self, subject):
+        return self.meta['subjects'][subject]
+
+    def column(self, subject, column):
+        """内存映射读取一个受试者的一列"""
+        if self.info(subject)['rows'] == 0:
+            return np.zeros(0, dtype=COLUMNS[column])
+        return np.memmap(_column_path(self.store_dir, subject, column), dtype=COLUMNS[column], mode='r')
+
+    def ingest(self, data_dir, workers=None):
+        """
+        递归扫描data_dir下的受试者CSV并行导入，只处理新增或有变化的文件
+        :return: 本次导入的受试者数
+        """
+        tasks = []
+        for root, _, files in os.walk(data_dir):
+            for file in files:
+                match = SUBJECT_PATTERN.match(file)
+                if not match:
+                    continue
+                input_path = os.path.abspath(os.path.join(root, file))
+                subject = f"{match.group(1).lower()}_{int(match.group(2))}"
+                signature = file_signature(input_path)
+                entry = self.meta['subjects'].get(subject)
+                if entry is not None and entry['signature'] == signature:
+                    continue
+                tasks.append((subject, input_path, signature, match.group(1).lower()))
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_ingest_subject, input_path, self.store_dir, subject):
+                       (subject, input_path, signature, group)
+                       for subject, input_path, signature, group in tasks}
+            for future in tqdm(futures, desc="导入进度"):
+                subject, input_path, signature, group = futures[future]
+                self.meta['subjects'][subject] = {
+                    "source": input_path, "signature": signature, "rows": future.result(),
+                    "group": group, "label": int(group == 'condition'),
+                }
+                self._save_meta()
+        return len(tasks)
+
+
+def _autocorr(x, lag):
+    """滞后lag的自相关系数，忽略缺失值；样本不足或无方差时返回NaN"""
+    if len(x) <= lag:
+        return np.nan
+    a, b = x[:-lag], x[lag:]
+    valid = ~(np.isnan(a) | np.isnan(b))
+    if valid.sum() < 3:
+        return np.nan
+    a, b = a[valid], b[valid]
+    a, b = a - a.mean(), b - b.mean()
+    denominator = np.sqrt((a * a).sum() * (b * b).sum())
+    return float((a * b).sum() / denominator) if denominator > 0 else np.nan
+
+
+def extract_features(store_dir, subject):
+    """
+    单个受试者的特征（可在子进程中执行），全部为numpy向量化计算：
+    整体均值/标准差/变异系数/零值比例，记录天数、日总量均值/标准差、小时均值的标准差，
+    昼夜比、白天与夜间活动量，分钟级与小时级自相关，
+    以及活动节律常用的日间稳定性(IS)与日内变异性(IV)
+    """
+    store = SeriesStore(store_dir)
+    seconds = np.asarray(store.column(subject, 'time'))
+    values = np.asarray(store.column(subject, 'value'), dtype=np.float64)
+    features = {"subject": subject}
+    if len(values) == 0:
+        return features
+
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    mean = values[valid].mean() if valid.any() else np.nan
+    std = values[valid].std() if valid.any() else np.nan
+    features.update(mean=mean, std=std, cv=std / mean if mean else np.nan,
+                    zero_ratio=float((values[valid] == 0).mean()) if valid.any() else np.nan)
+
+    # 以首个整点为起点划分小时与日，bincount一次得到全部分组合计
+    hour_index = (seconds - seconds.min() // 3600 * 3600) // 3600
+    hourly_sum = np.bincount(hour_index, weights=filled)
+    hourly_count = np.bincount(hour_index, weights=valid.astype(np.float64))
+    hourly = np.where(hourly_count > 0, hourly_sum / np.maximum(hourly_count, 1), np.nan)
+
+    day_index = (seconds // 86400) - seconds.min() // 86400
+    daily_sum = np.bincount(day_index, weights=filled)
+    daily_count = np.bincount(day_index, weights=valid.astype(np.float64))
+    complete = daily_count > 0
+    features.update(recorded_days=int(complete.sum()), daily_mean=daily_sum[complete].mean(),
+                    daily_std=daily_sum[complete].std(), hourly_std=np.nanstd(hourly))
+
+    hour_of_day = (seconds // 3600) % 24
+    profile_sum = np.bincount(hour_of_day, weights=filled, minlength=24)
+    profile_count = np.bincount(hour_of_day, weights=valid.astype(np.float64), minlength=24)
+    profile = np.where(profile_count > 0, profile_sum / np.maximum(profile_count, 1), np.nan)
+    day_mean = np.nanmean(profile[8:20])
+    night_mean = np.nanmean(np.r_[profile[:6], profile[22:]])
+    features.update(day_mean=day_mean, night_mean=night_mean,
+                    day_night_ratio=day_mean / night_mean if night_mean else np.nan,
+                    peak_hour=int(np.nanargmax(profile)) if np.isfinite(profile).any() else np.nan)
+
+    features.update(autocorr_minute=_autocorr(values, 1), autocorr_hour=_autocorr(hourly, 1),
+                    autocorr_day=_autocorr(hourly, 24))
+
+    # IS：24小时平均节律的方差占总体方差的比例；IV：相邻小时差分的均方与总体方差之比
+    hourly_valid = hourly[~np.isnan(hourly)]
+    variance = hourly_valid.var() if len(hourly_valid) else np.nan
+    if variance and variance > 0:
+        features['interdaily_stability'] = np.nanvar(profile) / variance
+        features['intradaily_variability'] = np.nanmean(np.diff(hourly) ** 2) / variance
+    else:
+        features['interdaily_stability'] = features['intradaily_variability'] = np.nan
+    return features
+
+
+def build_features(store_dir, workers=None, scores_path=None):
+    """
+    并行提取全部受试者特征并整理标签
+    :param scores_path: 标签表路径，含 number 列；其数值列按受试者编号并入标签
+    :return: (特征表, 标签表)，均以受试者为索引；标签表含分组label（抑郁组为1）
+    """
+    store = SeriesStore(store_dir)
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        rows = list(tqdm(executor.map(extract_features, [store_dir] * len(store.subjects),
+                                      store.subjects), total=len(store.subjects), desc="特征提取"))
+    features = pd.DataFrame(rows).set_index('subject')
+    labels = pd.DataFrame({'label': [store.info(subject)['label'] for subject in features.index]},
+                          index=features.index)
+
+    if scores_path and os.path.exists(scores_path):
+        scores = pd.read_csv(scores_path, encoding=detect_encoding(scores_path))
+        scores['number'] = scores['number'].astype(str).str.lower()
+        scores = scores.set_index('number').apply(pd.to_numeric, errors='coerce').dropna(axis=1, how='all')
+        labels = labels.join(scores.drop(columns=['label'], errors='ignore'), how='left')
+    return features, labels
+
+
+def label_correlation(features, labels, method='pearson'):
+    """
+    特征与标签的相关矩阵（行为特征，列为标签）；二分类标签的Pearson相关即点二列相关
+    """
+    features = features.select_dtypes(include=[np.number])
+    combined = features.join(labels, how='inner', rsuffix='_label')
+    matrix = combined.corr(method=method)
+    label_columns = [c for c in combined.columns if c not in features.columns]
+    return matrix.loc[features.columns, label_columns]
+
+
+if __name__ == "__main__":
+    # 路径配置
+    data_dir = r"D:\统计建模\初步处理后的包含抑郁字样的数据\数字数据\数据集_赵"
+    store_dir = r"D:\统计建模\初步处理后的包含抑郁字样的数据\数字数据\列存储"
+    output_path = r"D:\统计建模\初步处理后的包含抑郁字样的数据\数字数据\特征与相关性.xlsx"
+
+    store = SeriesStore(store_dir)
+    ingested = store.ingest(data_dir)
+    print(f"导入受试者 {ingested} 个，存储中共 {len(store.subjects)} 个")
+
+    features, labels = build_features(store_dir, scores_path=os.path.join(data_dir, SCORES_FILE))
+    correlation = label_correlation(features, labels)
+    print(correlation.round(3))
+
+    with pd.ExcelWriter(output_path) as writer:
+        features.join(labels).to_excel(writer, sheet_name='特征')
+        correlation.to_excel(writer, sheet_name='相关性')
+    print(f"结果已保存至: {output_path}")
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""
+表格数据读写公共层
+功能：脚本之间传递的中间结果统一使用Parquet/Feather（带列类型、可只读部分列、读写快），
+     Excel只用于给人看的最终导出；按扩展名自动选择格式，支持整表与分块两种读写方式
+"""
+
+import os
+from contextlib import contextmanager
+
+import pandas as pd
+
+from 运行指标 import metrics
+
+# ========== 用户配置 ==========
+INTERMEDIATE_EXT = '.parquet'  # 中间结果的默认格式：'.parquet'（zstd压缩）或 '.feather'（可内存映射）
+# ============================
+
+ARROW_EXTENSIONS = ('.parquet', '.feather', '.arrow')
+EXCEL_MAX_ROWS = 1048576  # Excel单个工作表的行数上限（含表头）
+
+
+def _ext(path):
+    return os.path.splitext(path)[1].lower()
+
+
+def _temp_path(path):
+    # 临时文件保留原扩展名，pandas按扩展名选择Excel引擎
+    root, ext = os.path.splitext(path)
+    return f"{root}.tmp{ext}"
+
+
+def file_signature(path):
+    """
+    文件大小与修改时间，两者都未变即视为文件未变，用于增量处理时跳过未变化的源文件；
+    返回列表，可与从JSON读回的记录直接比较
+    """
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """先写临时文件，成功后再替换为正式文件；写出中途失败时删除临时文件，正式文件保持不变"""
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, mode, **({} if 'b' in mode else {'encoding': 'utf-8'})) as f:
+            yield f
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
+
+
+def intermediate_path(path, suffix=''):
+    """把路径换成中间结果格式，如 QA1.xlsx → QA1_filtered.parquet"""
+    return os.path.splitext(path)[0] + suffix + INTERMEDIATE_EXT
+
+
+def _apply_dtype(df, dtype):
+    if dtype is None:
+        return df
+    if not isinstance(dtype, dict):
+        dtype = {col: dtype for col in df.columns}
+    for col, value in dtype.items():
+        if col not in df.columns:
+            continue
+        column = df[col]
+        if value is str:
+            # 与read_csv(dtype=str)一致，空值保持为空而不是变成'None'
+            df[col] = column.where(column.isna(), column.astype(str))
+        else:
+            df[col] = column.astype(value)
+    return df
+
+
+def table_columns(path):
+    """只读表头返回列名，不解析数据"""
+    ext = _ext(path)
+    if ext == '.parquet':
+        import pyarrow.parquet as pq
+        return [name for name in pq.read_schema(path).names if not name.startswith('__index_level_')]
+    if ext in ('.feather', '.arrow'):
+        import pyarrow as pa
+        return pa.ipc.open_file(pa.memory_map(path)).schema.names
+    if ext == '.csv':
+        from CSV转换工具 import detect_encoding
+        return list(pd.read_csv(path, nrows=0, encoding=detect_encoding(path)).columns)
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    try:
+        header = next(workbook.active.iter_rows(values_only=True), ())
+    finally:
+        workbook.close()
+    return list(header)
+
+
+def read_table(path, columns=None, dtype=None):
+    """
+    整表读取
+    :param columns: 只读取这些列；Parquet/Feather按列存储，未选中的列不会被解析
+    :param dtype: 列类型，字典或单一类型
+    """
+    ext = _ext(path)
+    with metrics.timer('file_read', format=ext.lstrip('.')):
+        return _read_table(path, ext, columns, dtype)
+
+
+def _read_table(path, ext, columns, dtype):
+    if ext == '.parquet':
+        df = pd.read_parquet(path, columns=columns)
+    elif ext in ('.feather', '.arrow'):
+        import pyarrow.feather as feather
+        # Feather不压缩时可直接内存映射
+        df = feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+    elif ext == '.csv':
+        from CSV转换工具 import detect_encoding
+        return pd.read_csv(path, usecols=columns, dtype=dtype, encoding=detect_encoding(path))
+    else:
+        return pd.read_excel(path, usecols=columns, dtype=dtype, engine='openpyxl')
+    return _apply_dtype(df, dtype)
+
+
+def write_table(df, path, index=False):
+    """整表写出，先写临时文件再替换，中途失败不会留下半个文件"""
+    ext = _ext(path)
+    temp_path = _temp_path(path)
+    with metrics.timer('file_write', format=ext.lstrip('.')):
+        if ext == '.parquet':
+            df.to_parquet(temp_path, index=index, compression='zstd')
+        elif ext in ('.feather', '.arrow'):
+            # Feather不保存行索引，需要时作为普通列写出
+            df.reset_index(drop=not index).to_feather(temp_path, compression='uncompressed')
+        elif ext == '.csv':
+            df.to_csv(temp_path, index=index, encoding='utf-8-sig')
+        else:
+            df.to_excel(temp_path, index=index, engine='openpyxl')
+        os.replace(temp_path, path)
+
+
+def iter_table_chunks(path, chunksize, columns=None, dtype=None):
+    """
+    按块读取，不把整个文件载入内存；各块的行索引连续，可作为数据行号
+    :param columns: 只读取这些列
+    :param dtype: 列类型，字典或单一类型；只用文本时传str，避免CSV中的数字被推断为数值
+    """
+    ext = _ext(path)
+    if ext == '.csv':
+        from CSV转换工具 import detect_encoding
+        yield from pd.read_csv(path, chunksize=chunksize, usecols=columns, dtype=dtype,
+                               encoding=detect_encoding(path))
+        return
+
+    start = 0
+    if ext in ARROW_EXTENSIONS:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if ext == '.parquet':
+            parquet_file = pq.ParquetFile(path)
+            batches = parquet_file.iter_batches(batch_size=chunksize, columns=columns)
+        else:
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            table = table.select(columns) if columns else table
+            batches = table.to_batches(max_chunksize=chunksize)
+        for batch in batches:
+            df = _apply_dtype(batch.to_pandas(), dtype)
+            df.index = range(start, start + len(df))
+            start += len(df)
+            yield df
+        return
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        positions = None if columns is None else [header.index(col) for col in columns]
+        buffer = []
+        for row in rows:
+            buffer.append(row if positions is None else [row[i] for i in positions])
+            if len(buffer) >= chunksize:
+                yield _apply_dtype(pd.DataFrame(buffer, columns=columns or header,
+                                                index=range(start, start + len(buffer))), dtype)
+                start += len(buffer)
+                buffer = []
+        if buffer:
+            yield _apply_dtype(pd.DataFrame(buffer, columns=columns or header,
+                                            index=range(start, start + len(buffer))), dtype)
+    finally:
+        workbook.close()
+
+
+def arrow_schema(df):
+    """由数据块推断Arrow列类型；object列全为空时无法推断，按字符串处理"""
+    import pyarrow as pa
+    schema = pa.Table.from_pandas(df, preserve_index=False).schema
+    return pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f
+                      for f in schema])
+
+
+def widen_schema(schema, other):
+    """
+    合并两个数据块推断出的列类型，用于后续块与已写出的类型冲突时：
+    一方为空类型取另一方；整数、浮点与布尔混合取float64；其余冲突一律退为字符串
+    """
+    import pyarrow as pa
+
+    def numeric(t):
+        return pa.types.is_integer(t) or pa.types.is_floating(t) or pa.types.is_boolean(t)
+
+    fields = []
+    for field in schema:
+        current, new = field.type, other.field(field.name).type
+        if current == new or pa.types.is_null(new):
+            widened = current
+        elif pa.types.is_null(current):
+            widened = new
+        elif numeric(current) and numeric(new):
+            widened = pa.float64()
+        else:
+            widened = pa.string()
+        fields.append(pa.field(field.name, widened))
+    return pa.schema(fields)
+
+
+def conform_chunk(df, schema):
+    """
+    把后续数据块对齐到已写出的列类型：
+    字符串列统一转为str；整数列允许出现空值（Arrow整数可为空）；整列为空时按该列类型写空值
+    类型无法对齐时抛出 pyarrow.ArrowInvalid / ArrowTypeError
+    """
+    import pyarrow as pa
+    df = df.copy()
+    for field in schema:
+        column = df[field.name]
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            df[field.name] = column.where(column.isna(), column.astype(str))
+        elif pa.types.is_null(field.type) or column.isna().all():
+            df[field.name] = None
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+class TableWriter:
+    """
+    分块增量写出：Parquet/Feather按首块推断的列类型流式写入，后续块类型冲突时放宽列类型
+    （如CSV中首块全空的列、后来出现小数的整数列）并重写已写出的部分；
+    CSV直接追加，xlsx使用openpyxl只写模式逐行写入，单表写满行数上限后新建工作表续写；
+    全部写完后才替换为正式文件
+    :param max_sheet_rows: xlsx单个工作表的行数上限（含表头）
+    """
+
+    def __init__(self, output_path, max_sheet_rows=EXCEL_MAX_ROWS):
+        self.output_path = output_path
+        self.count = 0
+        self.max_sheet_rows = max_sheet_rows
+        self._ext = _ext(output_path)
+        self._temp_path = _temp_path(output_path)
+        self._header_written = False
+        self._schema = None
+        self._writer = None
+        self._workbook = None
+        if self._ext == '.xlsx':
+            from openpyxl import Workbook
+            self._workbook = Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet('Sheet1')
+            self._sheet_count = 1
+            self._sheet_rows = 0
+            self._header = None
+        elif os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+
+    def write(self, df):
+        with metrics.timer('file_write', format=self._ext.lstrip('.')):
+            self._write(df)
+        self.count += len(df)
+
+    def _write(self, df):
+        if self._ext in ARROW_EXTENSIONS:
+            self._write_arrow(df)
+        elif self._workbook is not None:
+            if not self._header_written:
+                self._header = list(df.columns)
+                self._sheet.append(self._header)
+                self._sheet_rows = 1
+            # 空值写成空单元格
+            for row in df.astype(object).where(df.notna(), None).itertuples(index=False):
+                if self._sheet_rows >= self.max_sheet_rows:
+                    self._sheet_count += 1
+                    self._sheet = self._workbook.create_sheet(f'Sheet{self._sheet_count}')
+                    self._sheet.append(self._header)
+                    self._sheet_rows = 1
+                self._sheet.append(list(row))
+                self._sheet_rows += 1
+        else:
+            df.to_csv(self._temp_path, mode='a', index=False, header=not self._header_written,
+                      encoding='utf-8-sig' if not self._header_written else 'utf-8')
+        self._header_written = True
+
+    def _open_arrow(self, schema):
+        import pyarrow as pa
+        self._schema = schema
+        if self._ext == '.parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self._temp_path, schema, compression='zstd')
+        else:
+            # Feather v2即Arrow IPC文件格式，不压缩以便下游内存映射零拷贝读取
+            self._writer = pa.ipc.new_file(self._temp_path, schema)
+
+    def _write_arrow(self, df):
+        import pyarrow as pa
+        if self._schema is None:
+            self._open_arrow(arrow_schema(df))
+        try:
+            table = conform_chunk(df, self._schema)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            table = self._widen(df)
+        self._writer.write_table(table)
+
+    def _widen(self, df):
+        """放宽列类型：已写出的部分逐批读回、转换后写入新文件，内存占用只与批大小有关；再对齐当前块"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        # 当前块中整列为空的列不参与放宽
+        other = arrow_schema(df)
+        other = pa.schema([pa.field(f.name, pa.null()) if df[f.name].isna().all() else f for f in other])
+        schema = widen_schema(self._schema, other)
+        self._writer.close()
+        old_path = self._temp_path + '.old'
+        os.replace(self._temp_path, old_path)
+        try:
+            self._open_arrow(schema)
+            # 读完即关闭旧文件，Windows下仍被打开或映射的文件无法删除
+            with pa.memory_map(old_path) as source:
+                if self._ext == '.parquet':
+                    batches = pq.ParquetFile(source).iter_batches()
+                else:
+                    reader = pa.ipc.open_file(source)
+                    batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+                for batch in batches:
+                    self._writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+        finally:
+            os.remove(old_path)
+        return conform_chunk(df, schema)
+
+    def close(self, columns=None):
+        """
+        完成写出
+        :param columns: 一行都没写时用于生成空表的列名
+        """
+        if self._ext in ARROW_EXTENSIONS:
+            if self._writer is None:
+                self._write(pd.DataFrame(columns=list(columns or []), dtype=object))
+            self._writer.close()
+            self._writer = None
+        elif self._workbook is not None:
+            if not self._header_written:
+                self._sheet.append(list(columns or []))
+            with metrics.timer('file_write', format='xlsx'):
+                self._workbook.save(self._temp_path)
+            self._workbook = None
+        elif not self._header_written:
+            pd.DataFrame(columns=list(columns or [])).to_csv(self._temp_path, index=False,
+                                                              encoding='utf-8-sig')
+        if os.path.exists(self._temp_path):
+            os.replace(self._temp_path, self.output_path)
+
+    def discard(self):
+        """放弃写出，删除临时文件，正式文件保持不变"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._workbook = None
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+抑郁文本聚类分析
+功能：读取关键词筛选后的问答数据，jieba分词后用特征哈希得到稀疏词频，
+     按累计文档频率计算TF-IDF，MiniBatchKMeans增量聚类，输出每个簇最具区分度的关键词；
+     模型状态持久化，新增数据文件只需增量训练，不必从头重新拟合
+"""
+
+import os
+import pickle
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from NLP数据保留处理 import TEXT_COLUMNS, combine_text, iter_chunks
+from 数据读写 import TableWriter, atomic_write, file_signature
+
+# ========== 用户配置 ==========
+N_CLUSTERS = 8  # 簇个数
+N_FEATURES = 2 ** 18  # 特征哈希维度，越大哈希冲突越少
+TOP_KEYWORDS = 15  # 每个簇输出的关键词数
+CHUNK_SIZE = 5000  # 每块读取并训练的行数，需不小于簇个数
+STOPWORDS = {'的', '了', '是', '我', '你', '他', '她', '在', '有', '和', '就', '也', '都', '吗', '吧', '啊',
+             '呢', '这', '那', '会', '要', '不', '没有', '一个', '什么', '怎么', '怎么办', '可以', '如果',
+             '医生', '您好', '你好', '谢谢', '请问', '建议', '问题', '情况', '这种', '还是', '但是', '因为',
+             '所以', '现在', '已经', '比较', '可能', '需要', '一下', '这样', '自己', '时候'}
+# ============================
+
+STATE_FILE = 'cluster_state.pkl'
+TERMS_PER_BUCKET = 3  # 每个哈希桶保留的高频候选词数，用于把特征还原为词
+
+
+@lru_cache(maxsize=1)
+def _segmenter():
+    """每个进程只加载一次jieba词典"""
+    import jieba
+    jieba.setLogLevel(60)
+    jieba.initialize()
+    return jieba
+
+
+@lru_cache(maxsize=100000)
+def tokenize(text):
+    """分词并去掉停用词、单字和纯数字；重复出现的文本直接复用分词结果"""
+    return tuple(word for word in _segmenter().lcut(text)
+                 if len(word) > 1 and word not in STOPWORDS and not word.strip().isdigit())
+
+
+def _tokenize_batch(texts):
+    return [tokenize(text) for text in texts]
+
+
+def _identity(tokens):
+    return tokens
+
+
+class TextClusterer:
+    """
+    增量文本聚类
+    :param state_dir: 模型状态目录，已有状态时继续在其上训练
+    :param workers: 分词进程数，默认CPU核数；为1时在当前进程内分词
+    """
+
+    def __init__(self, state_dir, n_clusters=N_CLUSTERS, n_features=N_FEATURES, workers=None):
+        self.state_dir = state_dir
+        self.workers = workers or os.cpu_count() or 1
+        # 分词结果已是词列表，哈希器只负责映射到固定维度；不取反号，不归一化，保留原始词频
+        self.vectorizer = HashingVectorizer(n_features=n_features, analyzer=_identity,
+                                            alternate_sign=False, norm=None)
+        state_path = os.path.join(state_dir, STATE_FILE)
+        if os.path.exists(state_path):
+            with open(state_path, 'rb') as f:
+                self.state = pickle.load(f)
+            if self.state['n_features'] != n_features:
+                raise ValueError(f"特征维度不一致：已有 {self.state['n_features']}，当前 {n_features}")
+        else:
+            self.state = {
+                "n_features": n_features,
+                "model": MiniBatchKMeans(n_clusters=n_clusters, random_state=0, n_init=3),
+                "doc_freq": np.zeros(n_features, dtype=np.int64),
+                "n_docs": 0,
+                "bucket_terms": defaultdict(Counter),  # 哈希桶 → 落入该桶的词及其词频
+                "sources": {},
+                "pending": [],  # 首次训练前样本数不足簇个数时暂存的分词结果
+            }
+
+    @property
+    def model(self):
+        return self.state['model']
+
+    def save(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        with atomic_write(os.path.join(self.state_dir, STATE_FILE), 'wb') as f:
+            pickle.dump(self.state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _iter_tokens(self, input_path, chunksize, columns=None):
+        """
+        分块读取文本并并行分词，产出 (数据块, 分词结果)
+        :param columns: 只读取这些列，为None时读取全部列（标注时需要原样写出整行）
+        """
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            for chunk in iter_chunks(input_path, chunksize, columns=columns,
+                                     dtype=None if columns is None else str):
+                texts = combine_text(chunk).tolist()
+                if executor is None:
+                    tokens = _tokenize_batch(texts)
+                else:
+                    step = max(1, len(texts) // (self.workers * 4))
+                    batches = [texts[i:i + step] for i in range(0, len(texts), step)]
+                    tokens = [doc for batch in executor.map(_tokenize_batch, batches) for doc in batch]
+                yield chunk, tokens
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _tfidf(self, counts):
+        """用截至目前的累计文档频率加权，平滑方式与sklearn的TfidfTransformer一致"""
+        idf = np.log((1 + self.state['n_docs']) / (1 + self.state['doc_freq'])) + 1
+        return normalize(counts.multiply(idf).tocsr())
+
+    def _update_terms(self, tokens):
+        bucket_terms = self.state['bucket_terms']
+        word_counts = Counter(word for doc in tokens for word in doc)
+        if not word_counts:
+            return
+        # 每个词单独成一行哈希，一次调用得到全部词所在的桶
+        buckets = self.vectorizer.transform([[word] for word in word_counts]).indices
+        for (word, count), bucket in zip(word_counts.items(), buckets):
+            terms = bucket_terms[bucket]
+            terms[word] += count
+            if len(terms) > TERMS_PER_BUCKET * 2:
+                bucket_terms[bucket] = Counter(dict(terms.most_common(TERMS_PER_BUCKET)))
+
+    def partial_fit(self, tokens):
+        """用一批分词结果更新文档频率、哈希词表与聚类中心"""
+        counts = self.vectorizer.transform(tokens)
+        self.state['doc_freq'] += np.bincount(counts.indices, minlength=self.state['n_features'])
+        self.state['n_docs'] += counts.shape[0]
+        self._update_terms(tokens)
+        self.model.partial_fit(self._tfidf(counts))
+
+    @property
+    def fitted(self):
+        return hasattr(self.model, 'cluster_centers_')
+
+    def _check_fitted(self):
+        if not self.fitted:
+            raise ValueError(f"模型尚未训练：累计有效文档 {len(self.state.get('pending', []))} 条，"
+                             f"少于簇个数 {self.model.n_clusters}")
+
+    def add_source(self, input_path, chunksize=CHUNK_SIZE):
+        """
+        增量训练一个数据文件；文件大小与修改时间未变则跳过
+        首次训练前有效文档不足簇个数时，文档随状态暂存，与后续文件合并后再训练
+        :return: 参与训练的文档数，文件未变化时返回None
+        """
+        input_path = os.path.abspath(input_path)
+        signature = file_signature(input_path)
+        if self.state['sources'].get(input_path) == signature:
+            return None
+        n_clusters = self.model.n_clusters
+        trained = 0
+        pending = self.state.get('pending', [])
+        # 训练只用文本列
+        for _, tokens in self._iter_tokens(input_path, chunksize, columns=list(TEXT_COLUMNS)):
+            pending.extend(doc for doc in tokens if doc)
+            # 首次训练时样本数需不少于簇个数
+            if len(pending) >= max(chunksize, n_clusters):
+                self.partial_fit(pending)
+                trained += len(pending)
+                pending = []
+        if pending and (len(pending) >= n_clusters or self.fitted):
+            self.partial_fit(pending)
+            trained += len(pending)
+            pending = []
+        self.state['pending'] = pending
+        self.state['sources'][input_path] = signature
+        self.save()
+        return trained
+
+    def _term(self, bucket):
+        """哈希桶还原为落入该桶的最高频词"""
+        terms = self.state['bucket_terms'].get(bucket)
+        if not terms:
+            return None
+        return terms.most_common(1)[0][0]
+
+    def top_keywords(self, top=TOP_KEYWORDS):
+        """
+        每个簇最具区分度的关键词：簇中心权重减去其余簇中心的平均权重，
+        只看簇内高、簇间低的词，而非单纯的高频词
+        :return: {簇号: [(关键词, 得分), ...]}
+        """
+        self._check_fitted()
+        centers = self.model.cluster_centers_
+        n_clusters = centers.shape[0]
+        others = (centers.sum(axis=0, keepdims=True) - centers) / max(n_clusters - 1, 1)
+        scores = centers - others
+        keywords = {}
+        for cluster in range(n_clusters):
+            result = []
+            for bucket in np.argsort(-scores[cluster]):
+                if scores[cluster, bucket] <= 0 or len(result) >= top:
+                    break
+                term = self._term(bucket)
+                if term is not None:
+                    result.append((term, float(scores[cluster, bucket])))
+            keywords[cluster] = result
+        return keywords
+
+    def assign(self, input_path, output_path=None, chunksize=CHUNK_SIZE):
+        """为数据文件的每一行标注簇号，流式写出；返回各簇的行数"""
+        self._check_fitted()
+        if output_path is None:
+            base, ext = os.path.splitext(input_path)
+            output_path = f"{base}_clustered{ext}"
+        sizes = Counter()
+        writer = TableWriter(output_path)
+        try:
+            for chunk, tokens in self._iter_tokens(input_path, chunksize):
+                labels = self.model.predict(self._tfidf(self.vectorizer.transform(tokens)))
+                chunk = chunk.assign(cluster=labels)
+                sizes.update(labels.tolist())
+                writer.write(chunk)
+        except BaseException:
+            # 中途失败时保留上一次的输出，不发布不完整的标注结果
+            writer.discard()
+            raise
+        writer.close()
+        print(f"聚类标注完成，已保存至: {output_path}")
+        return sizes
+
+
+def export_keywords(keywords, sizes, output_path):
+    """簇关键词导出为Excel，每行一个簇"""
+    rows = [{"簇号": cluster, "行数": sizes.get(cluster, 0),
+             "关键词": '、'.join(term for term, _ in terms)}
+            for cluster, terms in keywords.items()]
+    pd.DataFrame(rows).to_excel(output_path, index=False)
+    print(f"簇关键词已保存至: {output_path}")
+
+
+if __name__ == "__main__":
+    # 路径配置：输入为 NLP数据保留处理.py 的筛选结果
+    state_dir = r"D:\统计建模\cMedQA-master\聚类模型"
+    source_files = [r"D:\统计建模\cMedQA-master\answers.csv\QA1_filtered.parquet"]
+    keywords_path = r"D:\统计建模\cMedQA-master\簇关键词.xlsx"
+
+    clusterer = TextClusterer(state_dir)
+    for path in source_files:
+        trained = clusterer.add_source(path)
+        if trained is None:
+            print(f"未变化，跳过: {path}")
+        else:
+            print(f"已训练: {path}（{trained} 条）")
+    if not clusterer.fitted:
+        print(f"有效文档不足 {clusterer.model.n_clusters} 条，暂不聚类")
+        raise SystemExit(1)
+
+    sizes = Counter()
+    for path in source_files:
+        sizes.update(clusterer.assign(path))
+    keywords = clusterer.top_keywords()
+    for cluster, terms in keywords.items():
+        print(f"簇 {cluster}（{sizes.get(cluster, 0)} 条）: {'、'.join(term for term, _ in terms)}")
+    export_keywords(keywords, sizes, keywords_path)
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+数据处理流水线
+功能：把 转换 → 关键词筛选 → 分类/聚类 → 分析 等独立脚本包装成有向无环图中的阶段，
+     每个阶段以 输入内容 + 参数 + 代码版本 的哈希为键，结果存入本地产物缓存，
+     上游未变化的阶段重跑时直接复用；相互独立的阶段并行执行，并报告各阶段耗时
+"""
+
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from CSV转换工具 import file_hash
+from 数据读写 import atomic_write, file_signature, read_table
+
+# ========== 用户配置 ==========
+CACHE_DIR = r"D:\统计建模\流水线缓存"  # 产物缓存目录
+MAX_PARALLEL = 2  # 同时执行的阶段数（各阶段内部另有自己的并行）
+NUMERIC_ROOT = r"D:\统计建模\初步处理后的包含抑郁字样的数据\数字数据\数据集_赵"
+QA_FILE = r"D:\统计建模\cMedQA-master\answers.csv\QA1.xlsx"
+COMMENT_FILE = r"D:\统计建模\初步处理后的包含抑郁字样的数据\数字数据\文字类推断_excel\情绪分析.xlsx"
+# ============================
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_IMPORT = re.compile(r'^\s*(?:from\s+(\S+)\s+import|import\s+(\S+))', re.MULTILINE)
+DONE_FILE = 'stage.json'
+
+_modules = {}
+_modules_lock = threading.Lock()
+
+
+def load_script(script):
+    """
+    按文件名加载脚本模块（文件名可含点号，如 CSV批量转化EXCEL2.0.py），同一脚本只加载一次
+    模块登记到sys.modules，其中的函数才能被pickle后交给子进程执行
+    """
+    with _modules_lock:
+        if script not in _modules:
+            path = os.path.join(SCRIPT_DIR, script)
+            name = os.path.splitext(script)[0].replace('.', '_')
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules.setdefault(name, module)
+            spec.loader.exec_module(module)
+            _modules[script] = module
+        return _modules[script]
+
+
+def code_version(script, _seen=None):
+    """脚本及其递归引用的本地模块的源码哈希，任一文件修改都会使阶段失效"""
+    seen = set() if _seen is None else _seen
+    digest = hashlib.sha256()
+    path = os.path.join(SCRIPT_DIR, script)
+    if script in seen or not os.path.exists(path):
+        return digest.hexdigest()
+    seen.add(script)
+    with open(path, 'rb') as f:
+        source = f.read()
+    digest.update(source)
+    for names in LOCAL_IMPORT.findall(source.decode('utf-8')):
+        for name in names:
+            local = name.split('.')[0] + '.py'
+            if name and os.path.exists(os.path.join(SCRIPT_DIR, local)):
+                digest.update(code_version(local, seen).encode())
+    return digest.hexdigest()
+
+
+class _InputHasher:
+    """外部输入的内容哈希，按 路径+大小+修改时间 缓存到产物目录，未变化的文件不重复读取"""
+
+    def __init__(self, cache_dir):
+        self.path = os.path.join(cache_dir, 'input_hashes.json')
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        self._lock = threading.Lock()
+
+    def _file(self, path):
+        signature = file_signature(path)
+        with self._lock:
+            entry = self.entries.get(path)
+        if entry is not None and entry[:2] == signature:
+            return entry[2]
+        digest = file_hash(path)
+        with self._lock:
+            self.entries[path] = signature + [digest]
+        return digest
+
+    def hash(self, path):
+        path = os.path.abspath(path)
+        if os.path.isfile(path):
+            return self._file(path)
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"输入不存在: {path}")
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file in sorted(files):
+                file_path = os.path.join(root, file)
+                digest.update(os.path.relpath(file_path, path).encode('utf-8'))
+                digest.update(self._file(file_path).encode())
+        return digest.hexdigest()
+
+    def save(self):
+        with self._lock:
+            with atomic_write(self.path) as f:
+                json.dump(self.entries, f, ensure_ascii=False)
+
+
+class Stage:
+    """
+    流水线阶段
+    :param name: 阶段名
+    :param script: 被包装的脚本文件名，其源码计入代码版本
+    :param run: 执行函数 run(module, inputs, output, **params)，把结果写到output
+    :param inputs: {输入名: 外部路径 或 '@上游阶段名'}
+    :param output: 产物在阶段目录中的文件名（或目录名）
+    :param params: 传给run的参数，计入缓存键；密钥等不应影响结果的值不要放在这里
+    """
+
+    def __init__(self, name, script, run, inputs=None, output='output', params=None):
+        self.name = name
+        self.script = script
+        self.run = run
+        self.inputs = inputs or {}
+        self.output = output
+        self.params = params or {}
+
+    @property
+    def upstream(self):
+        return [value[1:] for value in self.inputs.values() if value.startswith('@')]
+
+
+def _stage_key(stage, input_keys):
+    # 执行函数写在本文件中，其源码也计入，修改适配逻辑同样使阶段失效
+    runner = hashlib.sha256(inspect.getsource(stage.run).encode('utf-8')).hexdigest()
+    payload = json.dumps({"name": stage.name, "code": code_version(stage.script), "runner": runner,
+                          "params": stage.params, "output": stage.output, "inputs": input_keys},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:20]
+
+
+def _select(stages, targets):
+    """目标阶段及其全部上游"""
+    if not targets:
+        return list(stages)
+    needed = set()
+    todo = list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in stages:
+            raise KeyError(f"未知阶段: {name}")
+        if name not in needed:
+            needed.add(name)
+            todo.extend(stages[name].upstream)
+    return [name for name in stages if name in needed]
+
+
+def run_pipeline(stages, targets=None, force=False, cache_dir=CACHE_DIR, max_parallel=MAX_PARALLEL):
+    """
+    执行流水线
+    :param stages: 阶段列表
+    :param targets: 只执行这些阶段（及其上游），默认全部
+    :param force: 忽略缓存重新执行选中的阶段
+    :return: {阶段名: 产物路径}，失败或被跳过的阶段不在其中
+    """
+    stages = {stage.name: stage for stage in stages}
+    for stage in stages.values():
+        for upstream in stage.upstream:
+            if upstream not in stages:
+                raise KeyError(f"阶段 {stage.name} 依赖未知阶段: {upstream}")
+    selected = _select(stages, targets)
+    os.makedirs(cache_dir, exist_ok=True)
+    hasher = _InputHasher(cache_dir)
+
+    outputs, keys, report = {}, {}, {}
+    remaining = {name: set(stages[name].upstream) for name in selected}
+
+    def execute(name):
+        """在工作线程中执行一个阶段，返回 (状态, 产物路径, 耗时)"""
+        stage = stages[name]
+        started = time.perf_counter()
+        input_keys = {input_name: keys[value[1:]] if value.startswith('@') else hasher.hash(value)
+                      for input_name, value in stage.inputs.items()}
+        key = keys[name] = _stage_key(stage, input_keys)
+        stage_dir = os.path.join(cache_dir, name, key)
+        output = os.path.join(stage_dir, stage.output)
+        if not force and os.path.exists(os.path.join(stage_dir, DONE_FILE)):
+            return '缓存命中', output, time.perf_counter() - started
+
+        # 在.partial目录中执行，失败后重跑同一个键时阶段自带的日志/检查点可继续使用
+        partial_dir = stage_dir + '.partial'
+        if force:
+            # 强制重跑不沿用失败时留下的日志/检查点
+            for path in (stage_dir, partial_dir):
+                if os.path.exists(path):
+                    shutil.rmtree(path)
+        os.makedirs(partial_dir, exist_ok=True)
+        inputs = {input_name: outputs[value[1:]] if value.startswith('@') else os.path.abspath(value)
+                  for input_name, value in stage.inputs.items()}
+        stage.run(load_script(stage.script), inputs, os.path.join(partial_dir, stage.output),
+                  **stage.params)
+        elapsed = time.perf_counter() - started
+        with open(os.path.join(partial_dir, DONE_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"stage": name, "key": key, "inputs": input_keys, "params": stage.params,
+                       "seconds": elapsed, "finished": time.strftime('%Y-%m-%d %H:%M:%S')},
+                      f, ensure_ascii=False, indent=1, default=str)
+        os.replace(partial_dir, stage_dir)
+        return '已执行', output, elapsed
+
+    pipeline_started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=max_parallel)
+    running = {}
+    try:
+        while remaining or running:
+            for name in [n for n, deps in remaining.items() if not deps]:
+                del remaining[name]
+                running[executor.submit(execute, name)] = name
+                print(f"开始阶段: {name}")
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    status, output, elapsed = future.result()
+                except Exception as e:
+                    report[name] = ('失败', None, 0.0)
+                    print(f"阶段 {name} 失败: {e}")
+                    # 下游阶段全部跳过
+                    failed = {name}
+                    while True:
+                        blocked = [n for n, deps in remaining.items() if deps & failed]
+                        if not blocked:
+                            break
+                        for n in blocked:
+                            del remaining[n]
+                            report[n] = ('跳过', None, 0.0)
+                            failed.add(n)
+                    continue
+                outputs[name] = output
+                report[name] = (status, output, elapsed)
+                print(f"完成阶段: {name}（{status}，{elapsed:.1f} 秒）")
+                for deps in remaining.values():
+                    deps.discard(name)
+    finally:
+        executor.shutdown(cancel_futures=True)
+        hasher.save()
+
+    total = time.perf_counter() - pipeline_started
+    print(f"\n{'阶段':<10}{'状态':<8}{'耗时(秒)':>10}  产物")
+    for name in selected:
+        status, output, elapsed = report.get(name, ('未执行', None, 0.0))
+        print(f"{name:<10}{status:<8}{elapsed:>10.1f}  {output or ''}")
+    print(f"总耗时: {total:.1f} 秒")
+    with open(os.path.join(cache_dir, 'runs.jsonl'), 'a', encoding='utf-8') as f:
+        f.write(json.dumps({"finished": time.strftime('%Y-%m-%d %H:%M:%S'), "seconds": total,
+                            "stages": {name: {"status": value[0], "seconds": value[2]}
+                                       for name, value in report.items()}},
+                           ensure_ascii=False) + '\n')
+    return outputs
+
+
+# ========== 阶段定义：把各脚本的入口函数适配为 run(module, inputs, output, **params) ==========
+
+def _require_env(name):
+    value = os.getenv(name)
+    if not value:
+        raise RuntimeError(f"未设置环境变量 {name}")
+    return value
+
+
+def run_convert(module, inputs, output, **params):
+    module.convert_all_csv(inputs['csv_root'], output, **params)
+
+
+def run_filter(module, inputs, output, **params):
+    module.filter_depression_data(inputs['qa'], output_path=output, **params)
+
+
+def run_classify(module, inputs, output, **params):
+    classifier = module.DeepSeekClassifier(api_key=_require_env('DEEPSEEK_API_KEY'))
+    df = classifier.process_excel(inputs['filtered'], output, **params)
+    # process_excel出错时只打印并照常写出，有失败或未处理的行就判阶段失败，不缓存，重跑时从日志续跑
+    failed = df['reason'].isin(module.FAILED_REASONS + (module.UNFINISHED_REASON,)).sum()
+    if failed:
+        raise RuntimeError(f"{failed} 行分类失败或未处理")
+
+
+def run_translate(module, inputs, output, **params):
+    module.process_with_autosave(_require_env('BAIDU_APPID'), _require_env('BAIDU_SECRET_KEY'),
+                                 input_file=inputs['comments'], output_file=output,
+                                 checkpoint_file=os.path.splitext(output)[0] + '_checkpoint.jsonl')
+    # 失败的行以【翻译失败】标记写出，重跑时成功的行由翻译记忆直接命中
+    translated = read_table(output, columns=[module.COLUMN_NAME])[module.COLUMN_NAME].astype(str)
+    failed = translated.str.startswith('【翻译失败】').sum()
+    if failed:
+        raise RuntimeError(f"{failed} 行翻译失败")
+
+
+def run_cluster(module, inputs, output, **params):
+    clusterer = module.TextClusterer(os.path.join(os.path.dirname(output), 'model'), **params)
+    clusterer.add_source(inputs['filtered'])
+    sizes = clusterer.assign(inputs['filtered'],
+                             os.path.join(os.path.dirname(output), 'clustered.parquet'))
+    module.export_keywords(clusterer.top_keywords(), sizes, output)
+
+
+def run_features(module, inputs, output, **params):
+    store_dir = os.path.join(os.path.dirname(output), 'store')
+    module.SeriesStore(store_dir).ingest(inputs['numeric_root'])
+    features, labels = module.build_features(
+        store_dir, scores_path=os.path.join(inputs['numeric_root'], module.SCORES_FILE), **params)
+    correlation = module.label_correlation(features, labels)
+    with pd.ExcelWriter(output) as writer:
+        features.join(labels).to_excel(writer, sheet_name='特征')
+        correlation.to_excel(writer, sheet_name='相关性')
+
+
+PIPELINE = [
+    Stage('转换', 'CSV批量转化EXCEL2.0.py', run_convert,
+          inputs={'csv_root': NUMERIC_ROOT}, output='excel'),
+    Stage('筛选', 'NLP数据保留处理.py', run_filter,
+          inputs={'qa': QA_FILE}, output='filtered.parquet'),
+    Stage('分类', '学生化过滤.py', run_classify,
+          inputs={'filtered': '@筛选'}, output='classified.xlsx', params={'batch_size': 4}),
+    Stage('聚类', '文本聚类分析.py', run_cluster,
+          inputs={'filtered': '@筛选'}, output='keywords.xlsx'),
+    Stage('翻译', '英文自动化翻译.py', run_translate,
+          inputs={'comments': COMMENT_FILE}, output='translated.xlsx'),
+    Stage('特征', '数字数据特征分析.py', run_features,
+          inputs={'numeric_root': NUMERIC_ROOT}, output='features.xlsx'),
+]
+
+
+if __name__ == "__main__":
+    # 用法：python 流水线运行.py [阶段名 ...] [--force]
+    args = [arg for arg in sys.argv[1:] if arg != '--force']
+    run_pipeline(PIPELINE, targets=args or None, force='--force' in sys.argv)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+追加式结果日志
+功能：逐行把处理结果追加到JSONL文件，按批次fsync，程序中断后可从日志恢复进度
+"""
+
+import json
+import os
+import threading
+
+from 运行指标 import metrics
+
+
+class ResultJournal:
+    """
+    追加式JSONL日志（线程安全）
+    :param path: 日志文件路径
+    :param fsync_every: 每追加多少条记录强制落盘一次
+    """
+
+    def __init__(self, path, fsync_every=20):
+        self.path = path
+        self.fsync_every = fsync_every
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self, key_field="index"):
+        """读取已有日志，返回 {key_field的值: 记录}，同一键以最后一次写入为准"""
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 进程被杀时最后一行可能只写了一半，直接忽略
+                    continue
+                records[record[key_field]] = record
+        return records
+
+    def append(self, record):
+        with self._lock:
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                needs_newline = False
+                if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                    with open(self.path, 'rb') as f:
+                        f.seek(-1, os.SEEK_END)
+                        needs_newline = f.read(1) != b'\n'
+                self._file = open(self.path, 'a', encoding='utf-8')
+                if needs_newline:
+                    # 补齐上次中断留下的半行，避免与新记录粘连
+                    self._file.write('\n')
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._pending += 1
+            if self._pending >= self.fsync_every:
+                self._sync()
+
+    def _sync(self):
+        with metrics.timer('journal_fsync'):
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def sync(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+
+    def remove(self):
+        """处理全部完成后删除日志"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -10,11 +10,23 @@ from openai import OpenAI
 import os
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
+from 限流工具 import TokenBucket
+from 结果日志 import ResultJournal
+from 近重复检测 import NearDuplicateIndex, content_key
+from 运行指标 import metrics, run_metrics
+
+MAX_CONSECUTIVE_FAILURES = 5  # 连续多少次请求没有得到有效数据就停止
 
 class DepressionDataGenerator:
-    def __init__(self, api_key):
-        self.client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com")
+    def __init__(self, api_key, dedupe_path="case_signatures.sqlite", dedupe_threshold=0.8,
+                 base_url="https://api.deepseek.com"):
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.model = "deepseek-chat"
+        self.temperature = 0.7
+        # 近重复签名索引跨运行持久化，dedupe_path为None时不去重
+        self.dedupe = NearDuplicateIndex(dedupe_path, threshold=dedupe_threshold) if dedupe_path else None
 
         self.system_prompt = """请你按照以下规则帮我生成数据
 {
@@ -59,69 +71,159 @@ class DepressionDataGenerator:
 
 
 
-    def _generate_single_case(self):
-        """生成单条数据（带超时和重试）"""
-        for _ in range(3):  # 最大重试3次
+    @staticmethod
+    def _parse_cases(content):
+        """
+        解析一次返回中的全部案例：兼容顶层数组、{"任意键": [...]} 以及单个对象
+        只保留question/answer/reason齐全且非空的记录
+        """
+        result = json.loads(content)
+        if isinstance(result, dict):
+            lists = [value for value in result.values() if isinstance(value, list)]
+            result = lists[0] if lists else [result]
+        if not isinstance(result, list):
+            return []
+        return [item for item in result
+                if isinstance(item, dict)
+                and all(isinstance(item.get(key), str) and item[key].strip()
+                        for key in ['question', 'answer', 'reason'])]
+
+    def _generate_cases(self, rate_limiter=None):
+        """
+        生成一批数据（带超时和重试），返回其中全部有效案例
+        每次都是新的随机采样，不走响应缓存（缓存会让每次运行都重放同样的案例），
+        中断续跑由 _records.jsonl 日志负责
+        :param rate_limiter: 共享令牌桶
+        """
+        for attempt in range(3):  # 最大重试3次
+            if attempt:
+                metrics.incr('retries', script='生成')
             try:
-                response = self.client.chat.completions.create(
-                    model="deepseek-chat",
-                    messages=[
-                        {"role": "system", "content": self.system_prompt},
-                        {"role": "user", "content": "生成案例"}
-                    ],
-                    temperature=0.7,
-                    response_format={"type": "json_object"},
-                    timeout=30  # 增加超时设置
-                )
-                result = json.loads(response.choices[0].message.content)
-                if all(key in result for key in ['question', 'answer', 'reason']):
-                    return result
+                if rate_limiter is not None:
+                    rate_limiter.acquire()
+                with metrics.timer('api_call', script='生成'):
+                    response = self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": self.system_prompt},
+                            {"role": "user", "content": "生成案例"}
+                        ],
+                        temperature=self.temperature,
+                        response_format={"type": "json_object"},
+                        timeout=30  # 增加超时设置
+                    )
+                metrics.record_usage(response, script='生成')
+                content = response.choices[0].message.content
+                with metrics.timer('json_parse', script='生成'):
+                    cases = self._parse_cases(content)
+                if cases:
+                    return cases
+                metrics.incr('parse_failures', script='生成')
+            except json.JSONDecodeError as e:
+                metrics.incr('parse_failures', script='生成')
+                print(f"\nJSON解析失败: {str(e)}")
             except Exception as e:
+                metrics.incr('api_errors', script='生成')
                 print(f"\nAPI异常: {str(e)}")
-                time.sleep(2)
-        return None
-
-    def generate_data(self, num_records=10, output_path="data.xlsx"):
-        """稳健数据生成流程"""
+                with metrics.timer('retry_sleep', script='生成'):
+                    time.sleep(2)
+        return []
+
+    def generate_data(self, num_records=10, output_path="data.xlsx", max_workers=4,
+                      requests_per_second=2.0):
+        """
+        稳健数据生成流程：多线程并发请求，记录逐条写入日志，结束时一次性导出Excel
+        :param max_workers: 同时在途的请求数
+        :param requests_per_second: 所有线程共享的请求速率上限
+        """
         # 路径处理
         output_path = os.path.abspath(output_path.strip('"'))
         if not output_path.endswith('.xlsx'):
             output_path += '.xlsx'
 
+        # 上次中断时已写入日志的记录直接保留，样本序号接着往后编
+        journal = ResultJournal(output_path.replace(".xlsx", "_records.jsonl"))
+        existing = journal.load()
+        data = [existing[index] for index in sorted(existing)]
+        next_sample = max((record['sample_id'] for record in data), default=-1) + 1
+        if data:
+            print(f"从日志恢复 {len(data)} 条数据")
+
         # 初始化进度条
-        progress = tqdm(total=num_records, desc="生成进度")
-        data = []
-        retry_count = 0
+        progress = tqdm(total=num_records, initial=min(len(data), num_records), desc="生成进度")
+        rate_limiter = TokenBucket(requests_per_second)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {}
+        failures = 0
+        duplicates = 0
 
         try:
-            while len(data) < num_records and retry_count < 5:
-                record = self._generate_single_case()
-                if record:
-                    data.append({
-                        "问题描述": record["question"],
-                        "医生回复": record["answer"],
-                        "核心症状": record["reason"]
-                    })
-                    progress.update(1)
-                    retry_count = 0  # 成功时重置重试计数
-                else:
-                    retry_count += 1
-                    time.sleep(3)  # 失败时延长等待
-                time.sleep(1)  # 基础间隔
+            while len(data) < num_records and failures < MAX_CONSECUTIVE_FAILURES:
+                while len(futures) < max_workers:
+                    future = executor.submit(self._generate_cases, rate_limiter)
+                    futures[future] = next_sample
+                    next_sample += 1
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    sample_id = futures.pop(future)
+                    cases = future.result()
+                    before = len(data)
+                    for case_no, case in enumerate(cases):
+                        # 在途请求返回的多余案例直接丢弃，不超过请求的条数
+                        if len(data) >= num_records:
+                            break
+                        text = case["question"] + '\n' + case["answer"]
+                        if self.dedupe is not None and self.dedupe.add(
+                                content_key(f"{os.path.basename(output_path)}:{sample_id}:{case_no}", text),
+                                text) is not None:
+                            duplicates += 1
+                            continue
+                        record = {
+                            "index": len(data),
+                            "sample_id": sample_id,
+                            "问题描述": case["question"],
+                            "医生回复": case["answer"],
+                            "核心症状": case["reason"]
+                        }
+                        journal.append(record)
+                        data.append(record)
+                    # 整批无效或全部是近重复都计为失败，成功时重置失败计数
+                    if len(data) > before:
+                        failures = 0
+                    elif len(data) < num_records:
+                        failures += 1
+                    progress.update(min(len(data), num_records) - progress.n)
+            if failures >= MAX_CONSECUTIVE_FAILURES:
+                print(f"\n连续 {failures} 次未获得有效数据，提前结束")
         except KeyboardInterrupt:
             print("\n用户中断操作...")
-
-        # 安全保存
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            journal.close()
+            progress.close()
+
+        if self.dedupe is not None:
+            print(f"\n丢弃近重复记录 {duplicates} 条")
+            self.dedupe.report()
+            self.dedupe.commit()
+
+        # 安全保存；从更大规模的日志恢复时也只导出请求的条数
+        data = data[:num_records]
         if data:
             try:
                 temp_path = output_path.replace(".xlsx", "_temp.xlsx")
-                pd.DataFrame(data).to_excel(temp_path, index=False, engine='openpyxl')
+                columns = ["问题描述", "医生回复", "核心症状"]
+                pd.DataFrame(data, columns=columns).to_excel(temp_path, index=False, engine='openpyxl')
 
                 if os.path.exists(output_path):
                     os.replace(temp_path, output_path)
                 else:
                     os.rename(temp_path, output_path)
 
+                # 数据已完整写入Excel，日志不再需要
+                if len(data) >= num_records:
+                    journal.remove()
                 print(f"\n✅ 成功保存 {len(data)} 条数据到:\n{output_path}")
             except Exception as e:
                 print(f"保存失败: {str(e)}")
@@ -134,14 +236,15 @@ if __name__ == "__main__":
     num = 10
     while True:
         try:
-            num = int(input("生成数量（1-100）: ").strip() or "10")
-            if 1 <= num <= 100: break
-            print("请输入1-100之间的数字！")
+            num = int(input("生成数量（1-100000）: ").strip() or "10")
+            if 1 <= num <= 100000: break
+            print("请输入1-100000之间的数字！")
         except ValueError:
             print("请输入有效数字！")
 
     path = input("保存路径（默认：桌面）: ").strip() or os.path.join(os.path.expanduser("~"), "Desktop", "抑郁数据.xlsx")
 
     generator = DepressionDataGenerator(api_key)
-    generator.generate_data(num, path)
+    with run_metrics('生成'):
+        generator.generate_data(num, path)
     input("按回车键退出...")
\ No newline at end of file
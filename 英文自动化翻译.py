@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """
 批量翻译工具 - 带自动保存功能
-功能：自动翻译指定Excel列，每100条保存一次进度
+功能：自动翻译指定Excel列，每100条落盘一次检查点
 作者：DeepSeek
 """
 
@@ -14,15 +14,30 @@ import os
 import warnings
 from tqdm import tqdm
 from functools import wraps
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from 响应缓存 import ResponseCache
+from 限流工具 import AdaptiveRateController, ThrottledError
+from 结果日志 import ResultJournal
+from 数据读写 import read_table, write_table
+from 运行指标 import metrics, run_metrics
 
 # ========== 用户配置 ==========
 INPUT_FILE = r"D:\统计建模\初步处理后的包含抑郁字样的数据\数字数据\文字类推断_excel\情绪分析.xlsx"
 OUTPUT_FILE = r"D:\统计建模\初步处理后的包含抑郁字样的数据\数字数据\文字类推断_excel\情绪分析_翻译结果.xlsx"
-BACKUP_FILE = r"D:\统计建模\temp\translation_backup.xlsx"  # 进度备份文件
+CHECKPOINT_FILE = r"D:\统计建模\temp\translation_checkpoint.jsonl"  # 逐行翻译状态检查点
+MEMORY_FILE = r"D:\统计建模\temp\translation_memory.sqlite"  # 跨运行的翻译记忆库
+MEMORY_MAX_BYTES = 256 * 1024 * 1024  # 记忆库大小上限，超出按最近最少使用淘汰
 COLUMN_NAME = 'Comment'  # 需要翻译的列名
-SAVE_INTERVAL = 100  # 每处理100条保存一次
+SAVE_INTERVAL = 100  # 每处理100条检查点落盘一次
 MAX_RETRIES = 5  # 最大重试次数
-REQUEST_INTERVAL = 2  # 请求间隔（秒）
+INITIAL_RATE = 0.5  # 初始请求速率（次/秒），之后按接口反馈自动调节
+MAX_RATE = 10  # 请求速率上限（次/秒）
+MAX_CONCURRENCY = 4  # 最大并发请求数
+THROTTLE_CODES = {'54003', '54005', '52001', '52002'}  # 限流/超时/系统繁忙，应重试
+MAX_QUERY_CHARS = 5000  # 单次请求q参数的字符上限，多条评论用换行拼接
+API_URL = 'https://fanyi-api.baidu.com/api/trans/vip/translate'
 # ============================
 
 # 禁用SSL警告
@@ -55,105 +70,254 @@ def retry_request(func):
                     requests.exceptions.Timeout) as e:
                 wait_time = 2 ** retries  # 指数退避
                 print(f"网络错误: {str(e)}，{wait_time}秒后重试...")
-                time.sleep(wait_time)
+                metrics.incr('retries', script='翻译')
+                with metrics.timer('retry_sleep', script='翻译'):
+                    time.sleep(wait_time)
                 retries += 1
         print("超过最大重试次数，跳过本条")
         return None
     return wrapper
 
-@retry_request
-def translate_text(text, appid, secret_key):
-    """执行单次翻译"""
-    try:
+class BaiduTranslator:
+    """百度翻译客户端：复用连接池，并把多条文本按换行拼进同一次请求"""
+
+    def __init__(self, appid, secret_key, api_url=API_URL, pool_size=4):
+        self.appid = appid
+        self.secret_key = secret_key
+        self.api_url = api_url
+        self.session = requests.Session()
+        self.session.verify = False  # 禁用SSL验证
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @retry_request
+    def _request(self, query):
+        """执行单次请求，返回百度接口的原始JSON"""
         salt = random.randint(100000, 999999)
         sign = hashlib.md5(
-            (appid + text + str(salt) + secret_key).encode()
+            (self.appid + query + str(salt) + self.secret_key).encode()
         ).hexdigest()
-
-        with requests.Session() as session:
-            session.verify = False  # 禁用SSL验证
-            response = session.get(
-                'https://fanyi-api.baidu.com/api/trans/vip/translate',
+        with metrics.timer('api_call', script='翻译'):
+            response = self.session.get(
+                self.api_url,
                 params={
-                    'q': text[:5000],  # 限制文本长度
+                    'q': query,
                     'from': 'en',
                     'to': 'zh',
-                    'appid': appid,
+                    'appid': self.appid,
                     'salt': salt,
                     'sign': sign
                 },
                 timeout=50
             )
+        metrics.incr('query_chars', len(query), script='翻译')
+        with metrics.timer('json_parse', script='翻译'):
+            return response.json()
+
+    def translate_batch(self, texts):
+        """
+        一次请求翻译多条文本，返回与texts等长的译文列表，失败项为None
+        百度按换行切分q并逐段返回trans_result，因此文本内部的换行先替换为空格
+        遇到限流类错误码时抛出ThrottledError，由调用方降速后重试
+        """
+        segments = [' '.join(str(text).split())[:MAX_QUERY_CHARS] for text in texts]
+        translations = ['' if not segment else None for segment in segments]
+        positions = [i for i, segment in enumerate(segments) if segment]
+        if not positions:
+            return translations
 
-        result = response.json()
+        try:
+            result = self._request('\n'.join(segments[i] for i in positions))
+        except Exception as e:
+            metrics.incr('api_errors', script='翻译')
+            print(f"翻译异常: {str(e)}")
+            return translations
+        if result is None:
+            return translations
         if 'error_code' in result:
-            print(f"API错误 [{result['error_code']}]: {result['error_msg']}")
-            return None
-        return result['trans_result'][0]['dst']
+            if str(result['error_code']) in THROTTLE_CODES:
+                metrics.incr('throttled', script='翻译')
+                raise ThrottledError(result.get('error_msg', ''))
+            metrics.incr('api_errors', script='翻译')
+            print(f"API错误 [{result['error_code']}]: {result.get('error_msg', '')}")
+            return translations
 
-    except Exception as e:
-        print(f"翻译异常: {str(e)}")
-        raise
+        trans_result = result.get('trans_result', [])
+        if len(trans_result) == len(positions):
+            for i, item in zip(positions, trans_result):
+                translations[i] = item['dst']
+        elif len(positions) > 1:
+            # 分段数对不上时无法确定对应关系，退回逐条翻译
+            print(f"返回段数不一致({len(trans_result)}/{len(positions)})，改为逐条翻译")
+            for i in positions:
+                translations[i] = self.translate_batch([segments[i]])[0]
+        return translations
+
+    def translate(self, text):
+        return self.translate_batch([text])[0]
+
+def pack_batches(items, limit=MAX_QUERY_CHARS):
+    """
+    把 [(行号, 文本), ...] 按拼接后的字符数上限分组
+    单条超长文本独占一组（翻译时截断到上限）
+    """
+    batches, batch, chars = [], [], 0
+    for index, text in items:
+        length = min(len(text), limit) + 1  # +1为换行分隔符
+        if batch and chars + length > limit:
+            batches.append(batch)
+            batch, chars = [], 0
+        batch.append((index, text))
+        chars += length
+    if batch:
+        batches.append(batch)
+    return batches
+
+def normalize_text(text):
+    """翻译记忆的归一化键：合并空白并转小写"""
+    return ' '.join(str(text).split()).lower()
+
+def text_hash(text):
+    """检查点中用于校验原文未变的哈希"""
+    return hashlib.sha1(str(text).encode('utf-8')).hexdigest()
+
+_translators = {}
+
+def translate_text(text, appid, secret_key, api_url=API_URL):
+    """执行单次翻译（复用同一凭证和接口地址下的连接池）"""
+    translator = _translators.get((appid, secret_key, api_url))
+    if translator is None:
+        translator = _translators[(appid, secret_key, api_url)] = BaiduTranslator(
+            appid, secret_key, api_url=api_url)
+    return translator.translate(text)
 
-def process_with_autosave(appid, secret_key):
+def process_with_autosave(appid, secret_key, input_file=INPUT_FILE, output_file=OUTPUT_FILE,
+                          checkpoint_file=CHECKPOINT_FILE, memory_file=MEMORY_FILE, api_url=API_URL):
     """带自动保存的处理流程"""
     # 初始化数据
-    if os.path.exists(BACKUP_FILE):
-        df = pd.read_excel(BACKUP_FILE, engine='openpyxl')
-        processed = df[df[COLUMN_NAME].notna()].index[-1] + 1
-        print(f"检测到备份文件，从第{processed}条继续...")
-    else:
-        df = pd.read_excel(INPUT_FILE, engine='openpyxl')
-        df[COLUMN_NAME] = df[COLUMN_NAME].astype(str)
-        processed = 0
-
+    df = read_table(input_file)
+    df[COLUMN_NAME] = df[COLUMN_NAME].astype(str)
     total = len(df)
-    progress_bar = tqdm(total=total, initial=processed, desc="翻译进度")
+
+    # 检查点只记录已完成的行，原文哈希一致且翻译成功的行直接回填；失败的行重新翻译
+    checkpoint = ResultJournal(checkpoint_file, fsync_every=SAVE_INTERVAL)
+    restored = 0
+    for index, record in checkpoint.load().items():
+        if (record['status'] == 'success' and index < total
+                and record['key'] == text_hash(df.at[index, COLUMN_NAME])):
+            df.at[index, COLUMN_NAME] = f"【翻译成功】{record['text']}"
+            restored += 1
+    if restored:
+        print(f"检测到检查点，已恢复 {restored} 条翻译结果")
+
+    progress_bar = tqdm(total=total, desc="翻译进度")
+    translator = BaiduTranslator(appid, secret_key, api_url=api_url)
+    memory = ResponseCache(memory_file, max_bytes=MEMORY_MAX_BYTES)
+
+    # 跳过空文本和已翻译文本，其余按归一化文本去重
+    groups = {}
+    for index in range(total):
+        original_text = df.at[index, COLUMN_NAME]
+        if pd.isna(original_text) or original_text.startswith(("【翻译成功】", "【翻译失败】")):
+            progress_bar.update(1)
+            continue
+        groups.setdefault(normalize_text(original_text), []).append((index, original_text))
+    pending_rows = sum(len(rows) for rows in groups.values())
+    print(f"待翻译 {pending_rows} 行，去重后 {len(groups)} 条唯一文本")
+
+    def fill_rows(key, translated):
+        """把一条译文回填到所有归一化后相同的行，并逐行记入检查点"""
+        for index, original_text in groups[key]:
+            if translated:
+                df.at[index, COLUMN_NAME] = f"【翻译成功】{translated}"
+            else:
+                df.at[index, COLUMN_NAME] = f"【翻译失败】{original_text}"
+            checkpoint.append({
+                "index": index,
+                "key": text_hash(original_text),
+                "status": "success" if translated else "failed",
+                "text": translated or "",
+            })
+        progress_bar.update(len(groups[key]))
 
     try:
-        for index in range(processed, total):
-            original_text = df.at[index, COLUMN_NAME]
+        # 先用翻译记忆命中的结果回填，只有未命中的唯一文本才请求API
+        pending = []
+        for key, rows in groups.items():
+            translated = memory.get(ResponseCache.make_key('en', 'zh', key))
+            if translated is not None:
+                fill_rows(key, translated)
+            else:
+                pending.append((key, rows[0][1]))
 
-            # 跳过空文本和已翻译文本
-            if pd.isna(original_text) or original_text.startswith(("【翻译成功】", "【翻译失败】")):
-                progress_bar.update(1)
-                continue
+        controller = AdaptiveRateController(initial_rate=INITIAL_RATE, max_rate=MAX_RATE,
+                                            max_concurrency=MAX_CONCURRENCY)
 
-            # 执行翻译
+        def run_batch(batch):
+            """在控制器限速下翻译一批文本，被限流时返回None交由主循环重新排队"""
+            controller.acquire()
+            start = time.monotonic()
             try:
-                translated = translate_text(original_text, appid, secret_key)
-                if translated:
-                    df.at[index, COLUMN_NAME] = f"【翻译成功】{translated}"
-                else:
-                    df.at[index, COLUMN_NAME] = f"【翻译失败】{original_text}"
-            except:
-                df.at[index, COLUMN_NAME] = f"【翻译失败】{original_text}"
+                translations = translator.translate_batch([text for _, text in batch])
+            except ThrottledError:
+                controller.on_throttle()
+                return None
+            # 签名错误、IP不在白名单等非限流错误时整批返回None，不能当作成功来提速
+            if any(translations):
+                controller.on_success(time.monotonic() - start)
+            else:
+                controller.on_error()
+            return translations
 
-            # 定期保存
-            if (index + 1) % SAVE_INTERVAL == 0:
-                df.to_excel(BACKUP_FILE, index=False, engine='openpyxl')
-                df.to_excel(OUTPUT_FILE, index=False, engine='openpyxl')
-                print(f"\n已保存 {index+1}/{total} 条进度")
+        queue = deque((batch, 0) for batch in pack_batches(pending))
+        futures = {}
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+            while queue or futures:
+                while queue and len(futures) < controller.concurrency:
+                    batch, attempts = queue.popleft()
+                    futures[executor.submit(run_batch, batch)] = (batch, attempts)
 
-            progress_bar.update(1)
-            time.sleep(REQUEST_INTERVAL + random.uniform(0, 1))  # 随机间隔
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    batch, attempts = futures.pop(future)
+                    translations = future.result()
+                    if translations is None:
+                        # 被限流的批次重新排队，超过重试上限才判为失败
+                        if attempts + 1 < MAX_RETRIES:
+                            queue.append((batch, attempts + 1))
+                            continue
+                        translations = [None] * len(batch)
+                    for (key, _), translated in zip(batch, translations):
+                        if translated:
+                            memory.set(ResponseCache.make_key('en', 'zh', key), translated)
+                        fill_rows(key, translated)
+
+                progress_bar.set_postfix(速率=f"{controller.rate:.2f}/s", 并发=controller.concurrency,
+                                         限流=controller.throttle_count, 错误=controller.error_count)
+
+        stats = memory.stats()
+        print(f"\n翻译记忆命中: {stats['hits']} | 未命中: {stats['misses']} | 命中率: {stats['hit_rate']:.1%}")
+
+        # 只在结束时写一次Excel，全部完成后检查点不再需要
+        write_table(df, output_file)
+        checkpoint.remove()
 
     finally:
-        # 最终保存
-        df.to_excel(OUTPUT_FILE, index=False, engine='openpyxl')
-        if os.path.exists(BACKUP_FILE):
-            os.remove(BACKUP_FILE)
+        checkpoint.close()
         progress_bar.close()
+        memory.close()
 
 if __name__ == '__main__':
     app_id, secret_key = get_api_credentials()
-    os.makedirs(os.path.dirname(BACKUP_FILE), exist_ok=True)
+    os.makedirs(os.path.dirname(CHECKPOINT_FILE), exist_ok=True)
 
     try:
-        process_with_autosave(app_id, secret_key)
+        with run_metrics('翻译'):
+            process_with_autosave(app_id, secret_key)
         print("\n处理完成！结果已保存至:", OUTPUT_FILE)
     except Exception as e:
         print("\n程序异常终止:", str(e))
-        print("最新进度已备份在:", BACKUP_FILE)
+        print("最新进度已记录在检查点:", CHECKPOINT_FILE)
     finally:
         input("按回车键退出...")
\ No newline at end of file
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+运行指标
+功能：为调用API的脚本提供低开销的计数器与计时器（API调用、重试、解析失败、缓存命中、文件读写、
+     限速等待等），记录OpenAI返回的token用量，运行结束时导出为JSONL或Prometheus文本格式；
+     另有可选的采样分析器，定时采集各线程调用栈，事后定位真正的瓶颈
+用法：
+    from 运行指标 import metrics, run_metrics
+    with metrics.timer('api_call', script='分类'):
+        ...
+    with run_metrics('分类', profile=True):   # 脚本入口处，结束时导出并打印汇总
+        main()
+"""
+
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# ========== 用户配置 ==========
+METRICS_FILE = 'metrics.jsonl'  # 每次运行追加一行指标快照
+PROMETHEUS_FILE = 'metrics.prom'  # Prometheus文本格式（node_exporter textfile收集器可直接读取）
+PROFILE_FILE = 'profile.folded'  # 采样分析结果（折叠栈格式，可用flamegraph.pl或speedscope查看）
+PROFILE_INTERVAL = 0.01  # 采样间隔（秒）
+# ============================
+
+# 耗时直方图的桶上限（秒），与Prometheus默认桶一致并补充长耗时
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+
+class _Timing:
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def quantile(self, q):
+        """由直方图估计分位数（取所在桶的上限）"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+
+def _escape_label(value):
+    """按Prometheus文本格式转义标签值中的反斜杠、双引号和换行"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Metrics:
+    """线程安全的计数器与计时器集合，指标以 (名称, 标签) 区分"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = Counter()
+            self.timings = {}
+            self.started = time.time()
+
+    def incr(self, name, value=1, **labels):
+        with self._lock:
+            self.counters[_key(name, labels)] += value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            timing = self.timings.get(key)
+            if timing is None:
+                timing = self.timings[key] = _Timing()
+            timing.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """计时代码块，异常退出同样计入"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def record_usage(self, response, **labels):
+        """累计OpenAI兼容响应中的token用量"""
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return
+        for field in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+            value = getattr(usage, field, None)
+            if value:
+                self.incr(field, value, **labels)
+        # DeepSeek在usage中返回前缀缓存命中的token数
+        cached = getattr(usage, 'prompt_cache_hit_tokens', None)
+        if cached:
+            self.incr('prompt_cache_hit_tokens', cached, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "started": time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)),
+                "seconds": round(time.time() - self.started, 3),
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "timers": [{"name": name, "labels": dict(labels), "count": t.count,
+                            "sum": round(t.total, 6), "max": round(t.max, 6),
+                            "p50": round(t.quantile(0.5), 6), "p95": round(t.quantile(0.95), 6),
+                            "p99": round(t.quantile(0.99), 6)}
+                           for (name, labels), t in sorted(self.timings.items())],
+            }
+
+    def export_jsonl(self, path=METRICS_FILE, **run_labels):
+        """追加一行快照，run_labels（如运行名）一并写入"""
+        record = dict(run_labels, **self.snapshot())
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def export_prometheus(self, path=PROMETHEUS_FILE, prefix='nlp_depression_', **run_labels):
+        """
+        写出Prometheus文本格式：计数器为 *_total（counter），计时器为 *_seconds 直方图（histogram），
+        每个指标族带 # HELP / # TYPE 声明；run_labels附加到每条指标
+        """
+        def render(labels):
+            labels = dict(labels, **run_labels)
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in sorted(labels.items())) + '}'
+
+        lines = []
+        declared = set()
+
+        def declare(metric, kind, description):
+            # 每个指标族只声明一次，同族的各条序列排序后相邻
+            if metric not in declared:
+                declared.add(metric)
+                lines.append(f"# HELP {metric} {description}")
+                lines.append(f"# TYPE {metric} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                declare(f"{prefix}{name}_total", 'counter', f"{name} 累计值")
+                lines.append(f"{prefix}{name}_total{render(dict(labels))} {value}")
+            for (name, labels), timing in sorted(self.timings.items()):
+                metric = f"{prefix}{name}_seconds"
+                declare(metric, 'histogram', f"{name} 耗时（秒）")
+                cumulative = 0
+                for bound, count in zip(BUCKETS, timing.buckets):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{metric}_bucket{render(dict(labels, le=le))} {cumulative}")
+                lines.append(f"{metric}_sum{render(dict(labels))} {timing.total:.6f}")
+                lines.append(f"{metric}_count{render(dict(labels))} {timing.count}")
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+    def summary(self):
+        """按总耗时列出计时器，并列出全部计数器"""
+        snapshot = self.snapshot()
+        print(f"\n运行指标（共 {snapshot['seconds']:.1f} 秒）")
+        if snapshot['timers']:
+            print(f"{'计时器':<36}{'次数':>8}{'总耗时':>10}{'p50':>9}{'p95':>9}{'最大':>9}")
+            for t in sorted(snapshot['timers'], key=lambda t: -t['sum']):
+                name = t['name'] + ''.join(f" {k}={v}" for k, v in t['labels'].items())
+                print(f"{name:<36}{t['count']:>8}{t['sum']:>10.2f}{t['p50']:>9.3f}"
+                      f"{t['p95']:>9.3f}{t['max']:>9.3f}")
+        for c in snapshot['counters']:
+            name = c['name'] + ''.join(f" {k}={v}" for k, v in c['labels'].items())
+            print(f"  {name}: {c['value']}")
+
+
+metrics = Metrics()
+
+
+class SamplingProfiler:
+    """
+    采样分析器：后台线程按固定间隔读取所有线程的调用栈并计数，
+    开销只与采样频率有关，不需要改动被测代码
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def top(self, n=15):
+        """按栈顶函数（自身耗时）排序，返回 [(函数, 占全部线程样本的比例), ...]"""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [(function, count / total) for function, count in leaves.most_common(n)]
+
+    def write_folded(self, path=PROFILE_FILE):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def run_metrics(script, profile=False, metrics_path=METRICS_FILE, prometheus_path=PROMETHEUS_FILE,
+                profile_path=PROFILE_FILE):
+    """
+    包裹一次完整运行：开始时清零指标，结束时（含异常中断）导出指标文件并打印汇总
+    :param profile: 是否同时开启采样分析器，也可用环境变量 METRICS_PROFILE=1 开启
+    """
+    metrics.reset()
+    profiler = None
+    if profile or os.getenv('METRICS_PROFILE') == '1':
+        profiler = SamplingProfiler().start()
+    try:
+        yield metrics
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write_folded(profile_path)
+        metrics.export_jsonl(metrics_path, run=script)
+        metrics.export_prometheus(prometheus_path, run=script)
+        metrics.summary()
+        if profiler is not None:
+            # 比例按全部线程的样本计算，等待网络或锁的空闲线程也计入
+            print(f"\n采样 {profiler.samples} 次，自身耗时最多的函数：")
+            for function, share in profiler.top():
+                print(f"  {function}: {share:.1%}")
+            print(f"调用栈已保存至: {profile_path}")
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+近重复检测
+功能：基于字符shingle的MinHash + LSH，流式增量判断新记录是否与已见记录近似重复；
+     签名索引持久化到SQLite，跨多次运行去重依然有效
+"""
+
+import hashlib
+import sqlite3
+import zlib
+from collections import Counter
+
+import numpy as np
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def content_key(prefix, text):
+    """记录键：位置前缀加文本摘要，源文件修改或输出名复用后，位置相同但内容不同的记录不会沿用旧结论"""
+    return f"{prefix}:{hashlib.sha1(str(text).encode('utf-8')).hexdigest()[:16]}"
+
+
+def _false_rates(threshold, bands, rows, steps=200):
+    """数值积分估计给定分带方式下的误报率与漏报率"""
+    def probability(s):
+        return 1.0 - (1.0 - s ** float(rows)) ** float(bands)
+
+    def integrate(f, low, high):
+        # 梯形法
+        xs = np.linspace(low, high, steps)
+        ys = np.array([f(x) for x in xs])
+        return float(np.sum((ys[1:] + ys[:-1]) / 2 * np.diff(xs)))
+
+    false_positive = integrate(probability, 0.0, threshold)
+    false_negative = integrate(lambda s: 1.0 - probability(s), threshold, 1.0)
+    return false_positive, false_negative
+
+
+def optimal_bands(threshold, num_perm):
+    """选择误报与漏报加权和最小的 (分带数, 每带行数)"""
+    best, best_error = (1, num_perm), float('inf')
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        if rows == 0:
+            break
+        false_positive, false_negative = _false_rates(threshold, bands, rows)
+        error = 0.5 * false_positive + 0.5 * false_negative
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    增量近重复索引
+    :param path: SQLite索引路径，为None时只在内存中（不跨运行）
+    :param threshold: Jaccard相似度阈值，不低于该值视为近重复
+    :param num_perm: MinHash排列数，越大估计越准、越慢
+    :param shingle_size: 字符shingle长度
+    """
+
+    def __init__(self, path=None, threshold=0.8, num_perm=128, shingle_size=3, seed=1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+        self._conn = sqlite3.connect(path or ':memory:')
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS docs (key TEXT PRIMARY KEY, sig BLOB NOT NULL, rep TEXT);"
+            "CREATE TABLE IF NOT EXISTS bands (band INTEGER, hash BLOB, key TEXT);"
+            "CREATE INDEX IF NOT EXISTS idx_bands ON bands(band, hash);"
+            "CREATE TABLE IF NOT EXISTS params (name TEXT PRIMARY KEY, value TEXT);"
+        )
+        # 参数不同的签名不可比，已有索引按建立时的参数校验
+        stored = dict(self._conn.execute("SELECT name, value FROM params").fetchall())
+        current = {"num_perm": str(num_perm), "shingle_size": str(shingle_size), "seed": str(seed),
+                   "bands": str(self.bands)}
+        if stored and stored != current:
+            raise ValueError(f"索引参数不一致：已有 {stored}，当前 {current}")
+        self._conn.executemany("INSERT OR REPLACE INTO params VALUES (?, ?)", current.items())
+        self._conn.commit()
+        self._pending = 0
+
+    def _shingles(self, text):
+        text = ''.join(str(text).split())
+        k = self.shingle_size
+        if len(text) <= k:
+            return {text}
+        return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+    def signature(self, text):
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in self._shingles(text)),
+                             dtype=np.uint64)
+        permuted = (np.outer(hashes, self._a) + self._b) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=0)
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def add(self, key, text):
+        """
+        加入一条记录并返回其所属重复簇的代表键；不重复时返回None
+        同一键重复加入时直接返回上次的结论，因此重跑同一数据不会误判为重复；
+        键应由 content_key 生成，保证同一键对应同一文本
+        """
+        row = self._conn.execute("SELECT rep FROM docs WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            return row[0]
+
+        signature = self.signature(text)
+        candidates = set()
+        for band, band_hash in self._band_keys(signature):
+            candidates.update(k for (k,) in self._conn.execute(
+                "SELECT key FROM bands WHERE band = ? AND hash = ?", (band, band_hash)))
+
+        rep = None
+        best = self.threshold
+        for candidate in candidates:
+            sig = np.frombuffer(self._conn.execute(
+                "SELECT sig FROM docs WHERE key = ?", (candidate,)).fetchone()[0], dtype=np.uint64)
+            similarity = float(np.mean(sig == signature))
+            if similarity >= best:
+                rep, best = candidate, similarity
+
+        self._conn.execute("INSERT INTO docs VALUES (?, ?, ?)", (key, signature.tobytes(), rep))
+        if rep is None:
+            # 只有簇代表进入LSH分带表，重复记录归入代表所在的簇
+            self._conn.executemany("INSERT INTO bands VALUES (?, ?, ?)",
+                                   ((band, band_hash, key) for band, band_hash in self._band_keys(signature)))
+        self._pending += 1
+        if self._pending >= 500:
+            self.commit()
+        return rep
+
+    def commit(self):
+        self._conn.commit()
+        self._pending = 0
+
+    def cluster_sizes(self):
+        """返回 {代表键: 簇大小（含代表本身）}，只包含有重复的簇"""
+        sizes = Counter()
+        for (rep,) in self._conn.execute("SELECT rep FROM docs WHERE rep IS NOT NULL"):
+            sizes[rep] += 1
+        return {rep: count + 1 for rep, count in sizes.items()}
+
+    def report(self, top=10):
+        sizes = self.cluster_sizes()
+        duplicates = sum(sizes.values()) - len(sizes)
+        print(f"近重复簇 {len(sizes)} 个，重复记录 {duplicates} 条（阈值 {self.threshold}，"
+              f"{self.bands}带×{self.rows}行）")
+        histogram = Counter(sizes.values())
+        for size in sorted(histogram):
+            print(f"  簇大小 {size}: {histogram[size]} 个")
+        for rep, size in sorted(sizes.items(), key=lambda item: -item[1])[:top]:
+            print(f"  {rep}: {size} 条")
+        return sizes
+
+    def close(self):
+        self.commit()
+        self._conn.close()
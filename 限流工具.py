@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+限流工具
+功能：令牌桶限流，供各API调用脚本在多线程下共享请求速率；
+     以及根据限流错误码和响应延迟自动调节速率与并发的AIMD控制器
+"""
+
+import threading
+import time
+
+from 运行指标 import metrics
+
+
+class TokenBucket:
+    """线程安全的令牌桶：rate为每秒补充的令牌数，capacity为允许的突发量"""
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate必须大于0")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def set_rate(self, rate):
+        """调整补充速率，已积累的令牌保留"""
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+            self.capacity = max(1.0, self.rate)
+            self._tokens = min(self._tokens, self.capacity)
+
+    def acquire(self, tokens=1):
+        """阻塞直到取得令牌"""
+        start = time.perf_counter()
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    metrics.observe('rate_limit_wait', time.perf_counter() - start)
+                    return
+                wait_time = (tokens - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class ThrottledError(Exception):
+    """接口返回限流类错误，调用方应稍后重试而不是判为失败"""
+
+
+class AdaptiveRateController:
+    """
+    AIMD速率控制器：请求成功时加性提高速率和并发，遇到限流时乘性回退；
+    非限流类错误（如签名错误）只计数，不提速也不降速
+    :param initial_rate: 初始每秒请求数
+    :param increase: 每次成功增加的速率（请求/秒）
+    :param decrease: 限流时速率乘以的系数
+    :param target_latency: 响应超过该秒数视为拥塞，轻微降速且不再提高并发
+    """
+
+    def __init__(self, initial_rate=1.0, min_rate=0.2, max_rate=10.0, increase=0.1,
+                 decrease=0.5, max_concurrency=4, target_latency=5.0):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.rate = float(initial_rate)
+        self.concurrency = 1
+        self.throttle_count = 0
+        self.error_count = 0
+        self._successes = 0
+        self._bucket = TokenBucket(self.rate)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        self._bucket.acquire()
+
+    def on_success(self, latency):
+        with self._lock:
+            if latency > self.target_latency:
+                self.rate = max(self.min_rate, self.rate * 0.9)
+                self._successes = 0
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+                # 连续成功一轮（等于当前并发数）后并发加一
+                self._successes += 1
+                if self._successes >= self.concurrency:
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                    self._successes = 0
+            self._bucket.set_rate(self.rate)
+
+    def on_error(self):
+        with self._lock:
+            self.error_count += 1
+            self._successes = 0
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttle_count += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.concurrency = max(1, self.concurrency // 2)
+            self._successes = 0
+            self._bucket.set_rate(self.rate)